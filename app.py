@@ -3,24 +3,36 @@ from __future__ import annotations
 import os
 import csv
 import re
+import time
 from pathlib import Path
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from sqlalchemy import inspect
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, jsonify, request, session, render_template, redirect, url_for, flash
+from flask import Flask, has_request_context, jsonify, request, session, render_template, redirect, url_for, flash
 from dotenv import load_dotenv
+import click
 
 from config import Config
 from db import db
-from models import User, Product, CartItem, Order, OrderItem, PaymentMethod, Address, Category, Review
+from models import User, Product, Order, OrderItem, PaymentMethod, Address, Category, Review, ProductPopularity
 from helpers import error, current_user #moved these to their own file to fix circular imports, helpers.py
+from search import apply_search, install_search_index
+from ratings import record_review, rebuild_rating_aggregates
+from popularity import rebuild_popularity
+from checkout import cart_snapshot, init_checkout_snapshots
+from guest_cart import clear_guest_cart, load_guest_cart, purge_expired_guest_carts
+from idempotency import purge_expired_idempotency_keys
+from jobs import JobRunner, init_jobs, run_pending
+from cache import init_catalog_cache
+from assets import build_assets, init_assets
+from images import build_variants, file_hash, source_path, srcset, variants_current
 
 # Blueprints (API modules)
 from routes.auth import bp as auth_bp
-from routes.catalog import bp as catalog_bp
-from routes.cart import bp as cart_bp
-from routes.orders import bp as orders_bp
+from routes.catalog import bp as catalog_bp, compute_facets, review_page
+from routes.cart import bp as cart_bp, add_lines_to_cart, nav_cart_count
+from routes.orders import bp as orders_bp, backfill_order_summaries, order_page, summarize_orders
 from routes.options import bp as options_bp
 from routes.payment_methods import bp as payment_methods_bp
 
@@ -32,6 +44,10 @@ def create_app() -> Flask:
     app.config.from_object(Config)
 
     db.init_app(app)
+    init_catalog_cache(app)
+    init_checkout_snapshots(app)
+    init_assets(app)
+    init_jobs(app)
 
     # --- Standard JSON error schema ---
     @app.errorhandler(404)
@@ -55,18 +71,13 @@ def create_app() -> Flask:
     @app.context_processor
     def inject_nav():
         """Inject navbar data (user + cart badge count) into all templates."""
+        if not has_request_context():
+            # templates rendered by background jobs / CLI commands have no session
+            return {"current_year": datetime.utcnow().year}
         user = current_user()
-        if user:
-            count = (
-                db.session.query(db.func.coalesce(db.func.sum(CartItem.quantity), 0))
-                .filter(CartItem.user_id == user.id)
-                .scalar()
-            )
-        else:
-            count = sum((session.get("cart") or {}).values())
         return {
             "nav_user": user,
-            "nav_cart_count": int(count or 0),
+            "nav_cart_count": nav_cart_count(user),
             "current_year": datetime.utcnow().year,
         }
 
@@ -84,6 +95,8 @@ def create_app() -> Flask:
             local = value
         return local.strftime("%Y-%m-%d %I:%M %p")
 
+    app.add_template_filter(srcset, "srcset")
+
     @app.template_filter("toronto_dt_pretty")
     def toronto_dt_pretty(value):
         """Human-friendly Toronto timestamp (store in UTC, display local)."""
@@ -117,12 +130,11 @@ def create_app() -> Flask:
         }
 
         # Count products per category (case-insensitive on category_name).
-        counts = dict(
-            db.session.query(db.func.lower(Category.category_name), db.func.count(Product.id))
-            .join(Product, Product.category_id == Category.id)
-            .group_by(db.func.lower(Category.category_name))
-            .all()
-        )
+        # Facet counts are cached by catalog version, so this is usually free.
+        counts: dict[str, int] = {}
+        for c in compute_facets()["categories"]:
+            key = c["name"].lower()
+            counts[key] = counts.get(key, 0) + c["count"]
 
         categories = [
             {
@@ -143,15 +155,9 @@ def create_app() -> Flask:
 
         q = Product.query
 
+        rank = None
         if search:
-            like = f"%{search}%"
-            q = q.filter(
-                db.or_(
-                    Product.name.ilike(like),
-                    Product.description.ilike(like),
-                    Product.sku.ilike(like),
-                )
-            )
+            q, rank = apply_search(q, search)
 
         if category:
             q = q.join(Category).filter(db.func.lower(Category.category_name) == category.lower())
@@ -162,33 +168,19 @@ def create_app() -> Flask:
             q = q.order_by(Product.price_cents.desc(), Product.id.asc())
         elif sort == "newest":
             q = q.order_by(Product.created_at.desc(), Product.id.desc())
+        elif sort == "top_rated":
+            q = q.order_by(Product.rating_avg.desc(), Product.rating_count.desc(), Product.id.asc())
+        elif sort == "relevance" and rank is not None:
+            q = q.order_by(rank, Product.id.asc())
         else:
-            q = q.order_by(Product.id.asc())
+            # "popular": precomputed sales rank (see popularity.py)
+            q = q.outerjoin(ProductPopularity, ProductPopularity.product_id == Product.id).order_by(
+                db.func.coalesce(ProductPopularity.score, 0.0).desc(), Product.id.asc()
+            )
 
         products = q.limit(24).all()
-        categories = Category.query.order_by(Category.category_name.asc()).all()
-
-        # Batch-load rating stats for visible products to avoid N+1 queries.
-        product_ids = [p.id for p in products]
-        product_ratings = {}
-        if product_ids:
-            rows = (
-                db.session.query(
-                    Review.product_id,
-                    db.func.avg(Review.rating).label("avg_rating"),
-                    db.func.count(Review.id).label("review_count"),
-                )
-                .filter(Review.product_id.in_(product_ids))
-                .group_by(Review.product_id)
-                .all()
-            )
-            product_ratings = {
-                int(r.product_id): {
-                    "avg_rating": float(r.avg_rating) if r.avg_rating is not None else 0.0,
-                    "review_count": int(r.review_count or 0),
-                }
-                for r in rows
-            }
+        # Category options with per-category result counts for the current search (cached).
+        categories = compute_facets(search, category)["categories"]
 
         return render_template(
             "products.html",
@@ -197,29 +189,29 @@ def create_app() -> Flask:
             search=search,
             category=category,
             sort=sort,
-            product_ratings=product_ratings,
         )
 
     @app.get("/products/<int:product_id>")
     def web_product_detail(product_id: int):
         product = Product.query.get_or_404(product_id)
 
-        reviews = (
-            Review.query.filter(Review.product_id == product_id)
-            .order_by(Review.created_at.desc(), Review.id.desc())
-            .all()
-        )
+        # One page of reviews at a time ("More reviews" follows the cursor).
+        reviews_cursor = (request.args.get("reviews_cursor") or "").strip() or None
+        try:
+            reviews, next_reviews_cursor = review_page(
+                product_id, app.config["REVIEWS_PAGE_SIZE"], reviews_cursor, with_user=True
+            )
+        except ValueError:
+            return redirect(url_for("web_product_detail", product_id=product_id))
 
-        avg_rating = (
-            db.session.query(db.func.avg(Review.rating))
-            .filter(Review.product_id == product_id)
-            .scalar()
-        )
-        avg_rating = float(avg_rating) if avg_rating is not None else 0.0
+        # Precomputed on the product row (see ratings.py).
+        avg_rating = float(product.rating_avg or 0.0)
 
         # UI helpers (kept lightweight; no DB schema changes)
         current_uid = session.get("user_id")
-        has_user_reviewed = bool(current_uid) and any(r.user_id == current_uid for r in reviews)
+        has_user_reviewed = bool(current_uid) and db.session.query(
+            Review.query.filter_by(product_id=product_id, user_id=current_uid).exists()
+        ).scalar()
 
         # Optional "What's inside" list: allow authors to encode list-like descriptions.
         # Only render when it looks like an actual list (>= 2 items) to avoid noisy UI.
@@ -245,6 +237,9 @@ def create_app() -> Flask:
             product=product,
             reviews=reviews,
             avg_rating=avg_rating,
+            review_count=int(product.rating_count or 0),
+            reviews_cursor=reviews_cursor,
+            next_reviews_cursor=next_reviews_cursor,
             has_user_reviewed=has_user_reviewed,
             inside_items=inside_items,
             is_featured=is_featured,
@@ -276,6 +271,7 @@ def create_app() -> Flask:
 
         r = Review(user_id=user.id, product_id=product_id, rating=rating, comment=comment)
         db.session.add(r)
+        record_review(product_id, rating)
         db.session.commit()
 
         flash("Thanks! Your review was submitted.", "success")
@@ -316,36 +312,10 @@ def create_app() -> Flask:
 
         return s
 
-    def _cart_snapshot_for_user(user_id: int):
-        """Return (items, summary) for the current user's cart."""
-        items = CartItem.query.filter_by(user_id=user_id).all()
-        view_items = []
-        for ci in items:
-            p = ci.product
-            if not p:
-                continue
-            view_items.append(
-                {
-                    "product_id": p.id,
-                    "name": p.name,
-                    "image_url": p.image_url,
-                    "unit_price_cents": p.price_cents,
-                    "quantity": ci.quantity,
-                    "line_total_cents": p.price_cents * ci.quantity,
-                }
-            )
-
-        subtotal = sum(i["line_total_cents"] for i in view_items)
-        tax = int(subtotal * CHECKOUT_TAX_RATE)
-        shipping = 0
-        total = subtotal + tax + shipping
-        summary = {
-            "subtotal_cents": subtotal,
-            "tax_cents": tax,
-            "shipping_cents": shipping,
-            "total_cents": total,
-        }
-        return view_items, summary
+    def _cart_snapshot_for_user(user: User):
+        """Return (items, summary) for the current user's cart (cached per cart version, see checkout.py)."""
+        snap = cart_snapshot(user.id, user.cart_version or 0)
+        return snap["items"], snap["summary"]
 
     @app.get("/checkout/shipping")
     def checkout_shipping():
@@ -354,7 +324,7 @@ def create_app() -> Flask:
             flash("Please log in to checkout.", "info")
             return redirect(url_for("web_login"))
 
-        items, summary = _cart_snapshot_for_user(user.id)
+        items, summary = _cart_snapshot_for_user(user)
         if not items:
             flash("Your cart is empty.", "info")
             return redirect(url_for("web_cart"))
@@ -449,7 +419,7 @@ def create_app() -> Flask:
             flash("Please log in to checkout.", "info")
             return redirect(url_for("web_login"))
 
-        items, summary = _cart_snapshot_for_user(user.id)
+        items, summary = _cart_snapshot_for_user(user)
         if not items:
             flash("Your cart is empty.", "info")
             return redirect(url_for("web_cart"))
@@ -516,7 +486,7 @@ def create_app() -> Flask:
             flash("Please log in to checkout.", "info")
             return redirect(url_for("web_login"))
 
-        items, summary = _cart_snapshot_for_user(user.id)
+        items, summary = _cart_snapshot_for_user(user)
         if not items:
             flash("Your cart is empty.", "info")
             return redirect(url_for("web_cart"))
@@ -539,6 +509,7 @@ def create_app() -> Flask:
             "checkout_review.html",
             items=items,
             summary=summary,
+            cart_version=user.cart_version or 0,
             shipping=shipping,
             payment_method=pm,
             user=user,
@@ -645,56 +616,32 @@ def create_app() -> Flask:
         if not user:
             flash("Please log in to view your orders.", "info")
             return redirect(url_for("web_login"))
-        orders = Order.query.filter_by(user_id=user.id).order_by(Order.id.desc()).all()
-
-        order_item_counts: dict[int, int] = {}
-        order_previews: dict[int, dict] = {}
-        order_ids = [o.id for o in orders]
-
-        if order_ids:
-            # One query for item counts (avoid N+1).
-            rows = (
-                db.session.query(OrderItem.order_id, db.func.coalesce(db.func.sum(OrderItem.quantity), 0))
-                .filter(OrderItem.order_id.in_(order_ids))
-                .group_by(OrderItem.order_id)
-                .all()
-            )
-            order_item_counts = {int(oid): int(cnt or 0) for oid, cnt in rows}
-
-            # One query for a lightweight preview (first 2 product names + a thumbnail).
-            rows = (
-                db.session.query(OrderItem.order_id, Product.name, Product.image_url)
-                .join(Product, Product.id == OrderItem.product_id)
-                .filter(OrderItem.order_id.in_(order_ids))
-                .order_by(OrderItem.order_id.desc(), OrderItem.id.asc())
-                .all()
-            )
+        # One page at a time ("Older orders" follows the cursor); the count and preview
+        # queries below only cover the orders on this page.
+        orders_cursor = (request.args.get("orders_cursor") or "").strip() or None
+        try:
+            orders, next_orders_cursor = order_page(user.id, app.config["ORDERS_PAGE_SIZE"], orders_cursor)
+        except ValueError:
+            return redirect(url_for("web_orders"))
 
-            for oid, name, image_url in rows:
-                oid = int(oid)
-                preview = order_previews.setdefault(
-                    oid,
-                    {
-                        "image_url": image_url,
-                        "names": [],
-                        "more_count": 0,
-                    },
-                )
-
-                if not preview.get("image_url") and image_url:
-                    preview["image_url"] = image_url
-
-                if name:
-                    if len(preview["names"]) < 2:
-                        preview["names"].append(name)
-                    else:
-                        preview["more_count"] += 1
+        # Item counts and previews are stored on each order at creation (single-table read).
+        order_item_counts = {o.id: o.item_count for o in orders}
+        order_previews = {o.id: o.preview for o in orders}
+
+        # Orders from before those columns existed (until backfill-order-summaries runs).
+        missing = [o.id for o in orders if o.item_count is None]
+        if missing:
+            for oid, summary in summarize_orders(missing).items():
+                order_item_counts[oid] = summary["item_count"]
+                order_previews[oid] = summary["preview"]
 
         return render_template(
             "orders.html",
             orders=orders,
             order_item_counts=order_item_counts,
             order_previews=order_previews,
+            orders_cursor=orders_cursor,
+            next_orders_cursor=next_orders_cursor,
         )
 
     @app.get("/orders/<int:order_id>")
@@ -708,15 +655,22 @@ def create_app() -> Flask:
             return render_template("404.html"), 404
         items = OrderItem.query.filter_by(order_id=order.id).all()
 
-        subtotal_cents = sum(int(i.unit_price_cents) * int(i.quantity) for i in items)
         shipping_cents = 0
-        stored_total = int(getattr(order, "total_cents", 0) or 0)
-        if stored_total <= 0:
-            stored_total = subtotal_cents + int(subtotal_cents * CHECKOUT_TAX_RATE) + shipping_cents
-        tax_cents = stored_total - subtotal_cents - shipping_cents
-        if tax_cents < 0:
-            tax_cents = int(subtotal_cents * CHECKOUT_TAX_RATE)
-            stored_total = subtotal_cents + tax_cents + shipping_cents
+        if order.subtotal_cents is not None and order.tax_cents is not None:
+            # Stored at creation (see routes/orders.place_order).
+            subtotal_cents = order.subtotal_cents
+            tax_cents = order.tax_cents
+            stored_total = order.total_cents
+        else:
+            # Older orders: derive from the items.
+            subtotal_cents = sum(int(i.unit_price_cents) * int(i.quantity) for i in items)
+            stored_total = int(getattr(order, "total_cents", 0) or 0)
+            if stored_total <= 0:
+                stored_total = subtotal_cents + int(subtotal_cents * CHECKOUT_TAX_RATE) + shipping_cents
+            tax_cents = stored_total - subtotal_cents - shipping_cents
+            if tax_cents < 0:
+                tax_cents = int(subtotal_cents * CHECKOUT_TAX_RATE)
+                stored_total = subtotal_cents + tax_cents + shipping_cents
 
         summary = {
             "subtotal_cents": subtotal_cents,
@@ -744,42 +698,8 @@ def create_app() -> Flask:
             flash("This order has no items to add.", "info")
             return redirect(url_for("web_order_detail", order_id=order_id))
 
-        # Bulk fetch products + existing cart items to avoid N+1.
-        product_ids = list({int(i.product_id) for i in items if i.product_id is not None})
-        if not product_ids:
-            flash("No valid products found in this order.", "info")
-            return redirect(url_for("web_order_detail", order_id=order_id))
-
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        products_by_id = {int(p.id): p for p in products}
-
-        existing = CartItem.query.filter(
-            CartItem.user_id == user.id,
-            CartItem.product_id.in_(product_ids),
-        ).all()
-        existing_by_pid = {int(ci.product_id): ci for ci in existing}
-
-        added_qty = 0
-        skipped = 0
-        for oi in items:
-            pid = int(oi.product_id)
-            qty = int(getattr(oi, "quantity", 0) or 0)
-            if qty < 1:
-                continue
-            if pid not in products_by_id:
-                skipped += 1
-                continue
-
-            ci = existing_by_pid.get(pid)
-            if ci:
-                ci.quantity = int(ci.quantity) + qty
-            else:
-                ci = CartItem(user_id=user.id, product_id=pid, quantity=qty)
-                db.session.add(ci)
-                existing_by_pid[pid] = ci
-
-            added_qty += qty
-
+        # One product check + one multi-row upsert (see routes/cart.py:add_lines_to_cart).
+        added_qty, skipped = add_lines_to_cart(user.id, [(oi.product_id, oi.quantity) for oi in items])
         db.session.commit()
 
         if added_qty > 0:
@@ -951,6 +871,23 @@ def create_app() -> Flask:
                     )
                 if "category_id" not in product_cols:
                     ddl.append("ALTER TABLE products ADD COLUMN category_id INTEGER")
+                if "image_variants" not in product_cols:
+                    ddl.append("ALTER TABLE products ADD COLUMN image_variants JSON")
+
+                # Denormalized rating aggregates (see ratings.py).
+                rating_cols = ["rating_sum", "rating_count"] + [f"rating_{i}" for i in range(1, 6)]
+                added_rating_cols = "rating_avg" not in product_cols
+                for col in rating_cols:
+                    if col not in product_cols:
+                        ddl.append(f"ALTER TABLE products ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0")
+                        added_rating_cols = True
+                if "rating_avg" not in product_cols:
+                    ddl.append(
+                        "ALTER TABLE products ADD COLUMN rating_avg DOUBLE PRECISION NOT NULL DEFAULT 0"
+                        if dialect == "postgresql"
+                        else "ALTER TABLE products ADD COLUMN rating_avg REAL NOT NULL DEFAULT 0"
+                    )
+                    ddl.append("CREATE INDEX IF NOT EXISTS ix_products_rating_avg ON products (rating_avg)")
 
                 if ddl:
                     with db.engine.begin() as conn:
@@ -958,6 +895,62 @@ def create_app() -> Flask:
                             conn.exec_driver_sql(stmt)
                     print("DB schema compatibility updates applied to products table.")
 
+                if added_rating_cols:
+                    updated = rebuild_rating_aggregates()
+                    db.session.commit()
+                    print(f"Rating aggregates backfilled for {updated} products.")
+
+            # Version stamps used for ETags (cart version per user, order updated_at).
+            if "users" in table_names:
+                user_cols = {c["name"] for c in inspector.get_columns("users")}
+                if "cart_version" not in user_cols:
+                    with db.engine.begin() as conn:
+                        conn.exec_driver_sql("ALTER TABLE users ADD COLUMN cart_version INTEGER NOT NULL DEFAULT 0")
+                    print("DB schema compatibility updates applied to users table.")
+            if "orders" in table_names:
+                order_cols = {c["name"] for c in inspector.get_columns("orders")}
+                if "updated_at" not in order_cols:
+                    with db.engine.begin() as conn:
+                        conn.exec_driver_sql("ALTER TABLE orders ADD COLUMN updated_at TIMESTAMP")
+                        conn.exec_driver_sql("UPDATE orders SET updated_at = created_at WHERE updated_at IS NULL")
+                    print("DB schema compatibility updates applied to orders table.")
+
+                # Denormalized order summary (see routes/orders.order_summary).
+                summary_ddl = []
+                for col in ("subtotal_cents", "tax_cents", "item_count"):
+                    if col not in order_cols:
+                        summary_ddl.append(f"ALTER TABLE orders ADD COLUMN {col} INTEGER")
+                if "preview" not in order_cols:
+                    summary_ddl.append("ALTER TABLE orders ADD COLUMN preview JSON")
+                if summary_ddl:
+                    with db.engine.begin() as conn:
+                        for stmt in summary_ddl:
+                            conn.exec_driver_sql(stmt)
+                    updated = backfill_order_summaries()
+                    db.session.commit()
+                    print(f"Order summary columns added and backfilled for {updated} orders.")
+
+            # Composite index for keyset-paginated order history (see routes/orders.order_page).
+            if "orders" in table_names:
+                existing_indexes = {i.get("name") for i in inspector.get_indexes("orders")}
+                if "ix_orders_user_id_id" not in existing_indexes:
+                    with db.engine.begin() as conn:
+                        conn.exec_driver_sql(
+                            "CREATE INDEX IF NOT EXISTS ix_orders_user_id_id ON orders (user_id, id)"
+                        )
+                    print("DB schema compatibility updates applied to orders table (history index).")
+
+            # Composite index for keyset-paginated reviews (see routes/catalog.review_page).
+            if "reviews" in table_names:
+                existing_indexes = {i.get("name") for i in inspector.get_indexes("reviews")}
+                if "ix_reviews_product_created_id" not in existing_indexes:
+                    with db.engine.begin() as conn:
+                        conn.exec_driver_sql(
+                            "CREATE INDEX IF NOT EXISTS ix_reviews_product_created_id "
+                            "ON reviews (product_id, created_at, id)"
+                        )
+                    print("DB schema compatibility updates applied to reviews table.")
+
             # Add a unique index to prevent duplicate payment methods per user
             # (same brand + last4 + expiry). This is safe for Postgres and SQLite.
             if "payment_methods" in table_names:
@@ -975,6 +968,13 @@ def create_app() -> Flask:
                         # If duplicates already exist, index creation can fail.
                         # The API/UI layer also blocks duplicates going forward.
                         print("Warning: could not create unique index for payment_methods (duplicates may already exist).")
+
+            # Full-text search index (FTS5 on SQLite, tsvector + GIN on Postgres).
+            # create_all() only builds it for a brand-new products table.
+            if "products" in table_names:
+                with db.engine.begin() as conn:
+                    ok = install_search_index(conn)
+                print("Product search index ready." if ok else "Warning: full-text search unavailable; using ILIKE search.")
         print("DB initialized (tables created).")
 
     @app.cli.command("seed")
@@ -1104,6 +1104,55 @@ def create_app() -> Flask:
             ])
             db.session.commit()
 
+    @app.cli.command("build-images")
+    @click.option("--force", is_flag=True, help="Re-encode even if the source image is unchanged.")
+    def build_images_cmd(force):
+        """Generate resized WebP/JPEG product image derivatives (srcset) and record them."""
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print("Pillow is not installed. Run: pip install -r requirements.txt")
+            return
+
+        with app.app_context():
+            static_folder = Path(app.static_folder)
+            built = reused = skipped = 0
+            hashes: dict[Path, str] = {}
+
+            for p in Product.query.order_by(Product.id.asc()).all():
+                src = source_path(p.image_url, static_folder)
+                if not src:
+                    skipped += 1
+                    continue
+
+                if src not in hashes:
+                    hashes[src] = file_hash(src)
+                digest = hashes[src]
+
+                if not force and variants_current(p.image_variants, digest, static_folder):
+                    reused += 1
+                    continue
+
+                try:
+                    p.image_variants = build_variants(src, digest, static_folder, force=force)
+                except Exception as e:
+                    print(f"Could not process {src.name}: {e}")
+                    skipped += 1
+                    continue
+                built += 1
+
+            db.session.commit()
+            print(f"Product images: {built} built, {reused} unchanged, {skipped} skipped.")
+
+    @app.cli.command("build-assets")
+    def build_assets_cmd():
+        """Fingerprint + precompress (gzip/brotli) everything under static/ into static/dist."""
+        stats = build_assets(Path(app.static_folder))
+        print(f"Built {stats['files']} assets ({stats['gzip']} gzip, {stats['brotli']} brotli) -> static/dist/manifest.json")
+        if not stats["brotli_available"]:
+            print("Note: brotli not installed; only gzip variants were written.")
+        print("Restart the app to pick up the new manifest.")
+
     @app.cli.command("seed-reviews")
     def seed_reviews_cmd():
         """Seed demo users + reviews from reviews.csv.
@@ -1220,37 +1269,89 @@ def create_app() -> Flask:
                     existing.add(key)
                     created_reviews += 1
 
+            # Bulk import: one GROUP BY rebuild is cheaper than per-review increments.
+            if created_reviews:
+                rebuild_rating_aggregates()
             db.session.commit()
             print(
                 f"Seeded {created_reviews} reviews (created {created_users} users, skipped {skipped})."
             )
 
+    @app.cli.command("rebuild-popularity")
+    def rebuild_popularity_cmd():
+        """Recompute the sales-based popularity rank table from order history."""
+        with app.app_context():
+            ranked = rebuild_popularity()
+            db.session.commit()
+            print(f"Rebuilt popularity ranks ({ranked} products with sales).")
+
+    @app.cli.command("purge-guest-carts")
+    def purge_guest_carts_cmd():
+        """Delete expired server-side guest carts (GUEST_CART_STORE)."""
+        with app.app_context():
+            purged = purge_expired_guest_carts()
+            db.session.commit()
+            print(f"Purged {purged} expired guest carts.")
+
+    @app.cli.command("purge-idempotency-keys")
+    def purge_idempotency_keys_cmd():
+        """Delete expired Idempotency-Key results for order creation."""
+        with app.app_context():
+            purged = purge_expired_idempotency_keys()
+            db.session.commit()
+            print(f"Purged {purged} expired idempotency keys.")
+
+    @app.cli.command("run-jobs")
+    @click.option("--workers", type=int, default=None, help="Worker threads (default JOB_WORKERS).")
+    @click.option("--once", is_flag=True, help="Run the jobs that are due now, then exit.")
+    def run_jobs_cmd(workers, once):
+        """Run background jobs (order confirmation emails, ...) from the jobs table."""
+        if once:
+            with app.app_context():
+                stats = run_pending()
+            print(f"Ran {stats['done'] + stats['errors']} jobs ({stats['errors']} failed and were rescheduled or given up).")
+            return
+        runner = JobRunner(app, workers=workers or app.config["JOB_WORKERS"], poll_interval=app.config["JOB_POLL_INTERVAL"])
+        runner.start()
+        print(f"Job worker running with {runner.workers} threads; Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Stopping (waiting for running jobs)...")
+            runner.stop()
+
+    @app.cli.command("backfill-order-summaries")
+    def backfill_order_summaries_cmd():
+        """Fill subtotal/tax/item count/preview on orders created before those columns existed."""
+        with app.app_context():
+            updated = backfill_order_summaries()
+            db.session.commit()
+            print(f"Backfilled summaries for {updated} orders.")
+
+    @app.cli.command("rebuild-ratings")
+    def rebuild_ratings_cmd():
+        """Recompute denormalized product rating aggregates from reviews."""
+        with app.app_context():
+            updated = rebuild_rating_aggregates()
+            db.session.commit()
+            print(f"Rebuilt rating aggregates ({updated} products with reviews).")
+
     return app
 
 # merges the session cart into users database cart when they log in or register, 
 # so that non logged in users can still make a cart and it will sync to their account upon login/register
 def session_cart_to_user(user_id: int):
-    session_cart = session.get("cart", {})
+    session_cart = load_guest_cart()
     
     if not session_cart:
         return
     
-    for product_id_str, quantity in session_cart.items():
-        product_id = int(product_id_str)
-        
-        # see if item is already in someones cart
-        existing = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-        if existing:
-            #update the quanitiy if it is already there
-            existing.quantity += quantity
-        else:
-            #if not, add a new item
-            new_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-            db.session.add(new_item)
-    
+    # one product check + one bulk upsert; products that no longer exist are dropped
+    add_lines_to_cart(user_id, session_cart.items())
+    # clear the guest cart after done merging (same commit)
+    clear_guest_cart()
     db.session.commit()
-    # clear the sessions cart after done merging
-    session.pop("cart", None)
 
 
 #-----moved these to their own file, check in helpers.py!!-----
@@ -0,0 +1,129 @@
+"""
+Fingerprinted, precompressed static assets.
+
+`flask --app app.py build-assets` copies everything under static/ into
+static/dist/ with a content hash in the filename (css/site.css ->
+css/site.3f2a9c1b7e4d.css), writes gzip/brotli variants next to compressible
+files, and records the mapping in static/dist/manifest.json.
+
+Templates call `asset_url("css/site.css")`: with a manifest it points at
+/assets/<hashed name>, which is served with `Cache-Control: immutable` and the
+best precompressed encoding the client accepts. Without a manifest it falls
+back to the normal /static/ URL, so development needs no build step.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from pathlib import Path
+
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+DIST_DIRNAME = "dist"
+MANIFEST_NAME = "manifest.json"
+HASH_LENGTH = 12
+# One year; safe because the URL changes whenever the content does.
+IMMUTABLE_MAX_AGE = 31536000
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".json", ".webmanifest", ".txt", ".html", ".xml", ".ico", ".map"}
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def build_assets(static_folder: Path) -> dict:
+    """Fingerprint + precompress static files into static/dist. Returns stats."""
+    dist = static_folder / DIST_DIRNAME
+    if dist.exists():
+        shutil.rmtree(dist)
+    dist.mkdir(parents=True)
+
+    brotli = _brotli()
+    manifest: dict[str, str] = {}
+    stats = {"files": 0, "gzip": 0, "brotli": 0, "brotli_available": brotli is not None}
+
+    for src in sorted(static_folder.rglob("*")):
+        if not src.is_file() or dist in src.parents:
+            continue
+        rel = src.relative_to(static_folder).as_posix()
+        data = src.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+        hashed_rel = (Path(rel).parent / f"{src.stem}.{digest}{src.suffix}").as_posix()
+        dest = dist / hashed_rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(data)
+        manifest[rel] = hashed_rel
+        stats["files"] += 1
+
+        if src.suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+            continue
+        # Only keep a compressed variant when it is actually smaller.
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data):
+            dest.with_name(dest.name + ".gz").write_bytes(gz)
+            stats["gzip"] += 1
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                dest.with_name(dest.name + ".br").write_bytes(br)
+                stats["brotli"] += 1
+
+    (dist / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    return stats
+
+
+def load_manifest(static_folder: Path) -> dict:
+    path = static_folder / DIST_DIRNAME / MANIFEST_NAME
+    if not path.is_file():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def asset_url(filename: str) -> str:
+    """Jinja global: hashed /assets/ URL when built, plain /static/ URL otherwise."""
+    hashed = current_app.extensions.get("asset_manifest", {}).get(filename)
+    if hashed:
+        return url_for("assets", filename=hashed)
+    return url_for("static", filename=filename)
+
+
+def serve_asset(filename: str):
+    dist = os.path.join(current_app.static_folder, DIST_DIRNAME)
+    path = safe_join(dist, filename)
+    if path is None or filename == MANIFEST_NAME or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    accepted = request.accept_encodings
+    for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if accepted[enc] and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, enc
+            break
+
+    resp = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+def init_assets(app) -> None:
+    app.extensions["asset_manifest"] = load_manifest(Path(app.static_folder))
+    app.add_url_rule("/assets/<path:filename>", "assets", serve_asset)
+    app.add_template_global(asset_url, "asset_url")
@@ -0,0 +1,187 @@
+"""
+Response caching for catalog reads.
+
+- LRUCache: bounded, thread-safe LRU with a per-entry TTL and hit/miss/eviction counters.
+- Catalog version: a counter in the single-row catalog_version table, bumped in
+  the same transaction as any write to products, reviews or categories. Cache
+  keys and catalog ETags include it, so a write makes every older entry
+  unreachable (they age out of the LRU) and every older ETag stop matching.
+  Stock is not a catalog write: orders change it all the time, so catalog
+  responses read it live instead (routes/catalog.py).
+
+The LRU is per process, but the version is in the database: writes from other
+worker processes or CLI commands are seen on the next request, and a restart
+never hands out an old version again. It is read once per request.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from db import db, upsert
+from models import CatalogVersion, Category, Product, Review
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+# --- Catalog version ---
+
+_CATALOG_MODELS = (Product, Review, Category)
+CATALOG_VERSION_ROW = 1
+
+
+def catalog_version() -> int:
+    """Current catalog version (one primary-key SELECT, memoized for the request)."""
+    if "catalog_version" not in g:
+        version = db.session.query(CatalogVersion.version).filter_by(id=CATALOG_VERSION_ROW).scalar()
+        g.catalog_version = version or 0
+    return g.catalog_version
+
+
+def mark_catalog_changed(session=None) -> None:
+    """
+    Bump the catalog version when the current transaction commits.
+
+    Writes through the ORM entities are detected automatically; call this after
+    statements the listeners cannot see (Core UPDATEs on products.__table__,
+    upserts into tables that feed catalog responses).
+    """
+    (session or db.session).info["catalog_dirty"] = True
+
+
+def _bump_catalog_version(session) -> None:
+    upsert(CatalogVersion, [{"id": CATALOG_VERSION_ROW, "version": 1}], [CatalogVersion.id], add=("version",))
+
+
+@event.listens_for(Session, "before_flush")
+def _track_catalog_flush(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _CATALOG_MODELS):
+            session.info["catalog_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_catalog_statements(orm_execute_state):
+    # Bulk UPDATE/DELETE/INSERT statements (e.g. ratings.record_review) bypass flush.
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    if any(m.class_ in _CATALOG_MODELS for m in orm_execute_state.all_mappers):
+        orm_execute_state.session.info["catalog_dirty"] = True
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_before_commit(session):
+    # Flush first so pending catalog objects are seen by _track_catalog_flush.
+    # The bump is the last statement of the transaction, which keeps the
+    # version row locked (PostgreSQL) only for the commit itself.
+    session.flush()
+    if session.info.pop("catalog_dirty", False):
+        _bump_catalog_version(session)
+        session.info["catalog_bumped"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_version_on_commit(session):
+    if session.info.pop("catalog_bumped", False) and has_app_context():
+        g.pop("catalog_version", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("catalog_dirty", None)
+    session.info.pop("catalog_bumped", None)
+
+
+# --- Flask integration ---
+
+def init_catalog_cache(app) -> None:
+    app.extensions["catalog_cache"] = LRUCache(
+        maxsize=app.config.get("CATALOG_CACHE_SIZE", 256),
+        ttl=app.config.get("CATALOG_CACHE_TTL", 60),
+    )
+
+
+def get_catalog_cache() -> LRUCache:
+    return current_app.extensions["catalog_cache"]
+
+
+def cached_payload(key: tuple, build):
+    """
+    (payload, status) for a catalog response, from the catalog cache or
+    `build()` on a miss.
+
+    `build()` returns (payload, status) like a view; only 200 payloads are
+    cached. Hits are shared between requests, so treat the payload as
+    read-only (copy before changing it).
+    """
+    cache = get_catalog_cache()
+    full_key = (catalog_version(), *key)
+    payload = cache.get(full_key)
+    if payload is None:
+        payload, status = build()
+        if status != 200:
+            return payload, status
+        cache.set(full_key, payload)
+    return payload, 200
@@ -0,0 +1,180 @@
+"""
+Checkout cart snapshots.
+
+The three checkout pages and POST /api/orders all need the same priced view of
+the user's cart. It is built once and kept in an in-process LRU keyed by
+(user id, cart version, catalog version). Any cart change bumps the cart
+version and any product write bumps the catalog version, so an outdated
+snapshot is never looked up again.
+
+create_order places the order from the snapshot and commits only if
+users.cart_version is still the version the snapshot was taken at
+(claim_cart_version). A cart edited mid-checkout gets a 409 rather than an
+order for different items.
+
+Stock is reserved in the same transaction with one conditional UPDATE per line
+(reserve_stock). There are no SELECT ... FOR UPDATE locks, and rows are touched
+in product id order so concurrent checkouts cannot deadlock. The same UPDATE
+returns the product's current price, and the order is charged that price
+(reprice), not the one cached in the snapshot.
+"""
+from __future__ import annotations
+
+from flask import current_app
+from sqlalchemy import update
+
+from cache import LRUCache, catalog_version
+from db import db
+from models import CartItem, Product, User
+
+# Keep totals consistent with the cart module.
+TAX_RATE = 0.13
+
+
+def build_cart_snapshot(user_id: int, cart_version: int) -> dict:
+    """Items + totals for a user's cart (one query, no User join)."""
+    rows = (
+        db.session.query(CartItem.product_id, CartItem.quantity, Product.name, Product.image_url, Product.price_cents)
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+    items, unavailable = [], []
+    for product_id, quantity, name, image_url, price_cents in rows:
+        if name is None:
+            unavailable.append(product_id)
+            continue
+        items.append(
+            {
+                "product_id": product_id,
+                "name": name,
+                "image_url": image_url,
+                "unit_price_cents": int(price_cents),
+                "quantity": int(quantity),
+                "line_total_cents": int(price_cents) * int(quantity),
+            }
+        )
+
+    return {
+        "cart_version": cart_version,
+        "items": items,
+        # products deleted since they were added; checkout pages skip them, orders refuse them
+        "unavailable": unavailable,
+        "summary": cart_summary(items),
+    }
+
+
+def cart_summary(items: list[dict]) -> dict:
+    subtotal = sum(i["line_total_cents"] for i in items)
+    tax = int(subtotal * TAX_RATE)
+    shipping = 0
+    return {
+        "subtotal_cents": subtotal,
+        "tax_cents": tax,
+        "shipping_cents": shipping,
+        "total_cents": subtotal + tax + shipping,
+    }
+
+
+def reprice(items: list[dict], prices: dict[int, int]) -> tuple[list[dict], dict]:
+    """
+    Snapshot lines and summary at `prices` ({product_id: price_cents}, as
+    returned by reserve_stock). Orders are charged what the products table says
+    at commit time, even if the cached snapshot predates a price change.
+    """
+    lines = []
+    for line in items:
+        price = prices.get(line["product_id"], line["unit_price_cents"])
+        lines.append(dict(line, unit_price_cents=price, line_total_cents=price * line["quantity"]))
+    return lines, cart_summary(lines)
+
+
+def cart_snapshot(user_id: int, cart_version: int) -> dict:
+    """Cached snapshot for (user, cart version); built on a miss. Treat as read-only."""
+    cache: LRUCache = current_app.extensions["checkout_snapshots"]
+    key = (user_id, cart_version, catalog_version())
+    snap = cache.get(key)
+    if snap is None:
+        snap = build_cart_snapshot(user_id, cart_version)
+        cache.set(key, snap)
+    return snap
+
+
+def claim_cart_version(user_id: int, cart_version: int) -> bool:
+    """
+    Bump users.cart_version only if it still equals `cart_version`.
+
+    Runs in the caller's transaction; False means the cart changed since the
+    snapshot was taken and the caller must roll back.
+    """
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.cart_version == cart_version)
+        .values(cart_version=User.cart_version + 1)
+    )
+    return result.rowcount == 1
+
+
+def reserve_stock(lines) -> tuple[list[dict], dict[int, int]]:
+    """
+    Decrement stock for [(product_id, quantity), ...] in the caller's transaction.
+
+    Each line is `UPDATE products SET stock = stock - q WHERE id = :id AND
+    stock >= q AND is_available RETURNING price_cents`, so two checkouts can
+    never both take the last unit, and the price comes from the same row
+    version the stock was taken from.
+
+    Returns (failed, prices): one entry per line that could not be reserved
+    (the caller must roll back if there are any) and {product_id: price_cents}
+    for the reserved ones.
+
+    This does not bump the catalog version: listings and product detail read
+    stock live (routes/catalog.live_stock), so orders leave the catalog cache,
+    catalog ETags and other users' checkout snapshots alone.
+    """
+    products = Product.__table__
+    failed, prices = [], {}
+    for product_id, quantity in sorted(lines):
+        price = db.session.execute(
+            update(products)
+            .where(
+                products.c.id == product_id,
+                products.c.stock >= quantity,
+                products.c.is_available.is_(True),
+            )
+            .values(stock=products.c.stock - quantity)
+            .returning(products.c.price_cents)
+        ).scalar()
+        if price is None:
+            failed.append({"product_id": product_id, "requested": quantity})
+        else:
+            prices[product_id] = int(price)
+    if not failed:
+        return [], prices
+
+    rows = db.session.query(Product.id, Product.stock, Product.is_available).filter(
+        Product.id.in_([f["product_id"] for f in failed])
+    )
+    state = {pid: (stock, is_available) for pid, stock, is_available in rows}
+    for f in failed:
+        stock, is_available = state.get(f["product_id"], (0, False))
+        f["available"] = int(stock or 0) if is_available else 0
+        f["reason"] = "out_of_stock" if is_available else "unavailable"
+    return failed, prices
+
+
+def release_stock(lines) -> None:
+    """Give reserved stock back (order cancelled), in the caller's transaction."""
+    products = Product.__table__
+    for product_id, quantity in sorted(lines):
+        db.session.execute(
+            update(products).where(products.c.id == product_id).values(stock=products.c.stock + quantity)
+        )
+
+
+def init_checkout_snapshots(app) -> None:
+    app.extensions["checkout_snapshots"] = LRUCache(
+        maxsize=app.config.get("CHECKOUT_SNAPSHOT_CACHE_SIZE", 1024),
+        ttl=app.config.get("CHECKOUT_SNAPSHOT_TTL", 300),
+    )
@@ -17,3 +17,42 @@ class Config:
     # Simple pagination defaults
     DEFAULT_LIMIT = int(os.getenv("DEFAULT_LIMIT", "12"))
     MAX_LIMIT = int(os.getenv("MAX_LIMIT", "50"))
+    REVIEWS_PAGE_SIZE = int(os.getenv("REVIEWS_PAGE_SIZE", "10"))
+    ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "20"))
+
+    # In-process catalog response cache (see cache.py)
+    CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+    CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+    # Serve GET /api/catalog/cache-stats (internal counters; keep off in production)
+    CATALOG_CACHE_STATS = os.getenv("CATALOG_CACHE_STATS", "0").lower() in ("1", "true", "yes")
+
+    # Checkout cart snapshots, keyed by user + cart version (see checkout.py)
+    CHECKOUT_SNAPSHOT_CACHE_SIZE = int(os.getenv("CHECKOUT_SNAPSHOT_CACHE_SIZE", "1024"))
+    CHECKOUT_SNAPSHOT_TTL = float(os.getenv("CHECKOUT_SNAPSHOT_TTL", "300"))
+
+    # sort=popular: a sale's weight halves every N days (see popularity.py)
+    POPULARITY_HALF_LIFE_DAYS = float(os.getenv("POPULARITY_HALF_LIFE_DAYS", "14"))
+    # Cached sort=popular listings are re-ranked at most this often
+    POPULARITY_REFRESH_SECONDS = float(os.getenv("POPULARITY_REFRESH_SECONDS", "60"))
+
+    # Guest carts: signed session cookie by default. With GUEST_CART_STORE=1 the cookie
+    # only carries a token and the cart lives in the guest_carts table (see guest_cart.py).
+    GUEST_CART_STORE = os.getenv("GUEST_CART_STORE", "0").lower() in ("1", "true", "yes")
+    GUEST_CART_TTL_DAYS = float(os.getenv("GUEST_CART_TTL_DAYS", "30"))
+
+    # POST /api/orders Idempotency-Key results are kept this long (see idempotency.py)
+    IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+    # Background jobs (see jobs.py). JOBS_IN_PROCESS runs a worker pool inside the web
+    # process; turn it off when jobs are handled by `flask --app app.py run-jobs`.
+    JOBS_IN_PROCESS = os.getenv("JOBS_IN_PROCESS", "1").lower() in ("1", "true", "yes")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+    JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+    JOB_LOCK_TIMEOUT = float(os.getenv("JOB_LOCK_TIMEOUT", "300"))
+
+    # Outgoing email is written as .eml files here (see mailer.py); empty = <instance>/outbox
+    MAIL_OUTBOX_DIR = os.getenv("MAIL_OUTBOX_DIR", "")
+    MAIL_FROM = os.getenv("MAIL_FROM", "BoxedWithLove <orders@boxedwithlove.local>")
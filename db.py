@@ -1,3 +1,66 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 
 db = SQLAlchemy()
+
+ON_CONFLICT_DIALECTS = ("postgresql", "sqlite")
+
+
+def dialect_insert(entity):
+    """
+    INSERT construct for the session's dialect. On SQLite and Postgres it has
+    .on_conflict_do_update() / .on_conflict_do_nothing(); other dialects get a
+    plain insert() (use upsert() for portable insert-or-update).
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(entity)
+    if dialect == "sqlite":
+        return sqlite.insert(entity)
+    return insert(entity)
+
+
+def upsert(entity, rows: list[dict], index_elements: list, add=(), replace=(), returning=None):
+    """
+    Insert `rows`, or update the existing row with the same `index_elements`:
+    columns named in `add` are incremented by the new value, columns in
+    `replace` are overwritten. Runs in the caller's transaction.
+
+    SQLite/Postgres: one INSERT ... ON CONFLICT DO UPDATE, atomic under
+    concurrency. Other dialects: an UPDATE per row and an INSERT for rows that
+    matched nothing (a concurrent insert of the same key then fails with
+    IntegrityError instead of being merged).
+
+    Returns the `returning` columns for each row (in row order), else None.
+    """
+    if db.session.get_bind().dialect.name in ON_CONFLICT_DIALECTS:
+        stmt = dialect_insert(entity).values(rows)
+        set_ = {name: getattr(entity, name) + stmt.excluded[name] for name in add}
+        set_.update({name: stmt.excluded[name] for name in replace})
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+        if returning is None:
+            db.session.execute(stmt)
+            return None
+        if len(rows) == 1:
+            return db.session.execute(stmt.returning(*returning)).all()
+        db.session.execute(stmt)
+    else:
+        for row in rows:
+            key = [col == row[col.key] for col in index_elements]
+            values = {name: getattr(entity, name) + row[name] for name in add}
+            values.update({name: row[name] for name in replace})
+            result = db.session.execute(
+                update(entity).where(*key).values(values).execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                db.session.execute(insert(entity).values(row))
+        if returning is None:
+            return None
+
+    # multi-row ON CONFLICT ... RETURNING does not promise row order; read the rows back by key
+    out = []
+    for row in rows:
+        key = [col == row[col.key] for col in index_elements]
+        out.append(db.session.execute(select(*returning).where(*key)).one())
+    return out
@@ -0,0 +1,94 @@
+"""
+Guest (not logged in) cart storage.
+
+By default a guest cart lives in the signed session cookie as
+{product_id: quantity}, which is re-sent with every request. With
+GUEST_CART_STORE enabled the cookie only carries an opaque token and the cart
+is kept in the guest_carts table. It expires GUEST_CART_TTL_DAYS after its last
+change. Expired carts read as empty and are deleted by:
+flask --app app.py purge-guest-carts
+
+Both backends keep a version counter that is bumped on every change (cart_version).
+"""
+from __future__ import annotations
+
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app, g, session
+from sqlalchemy import delete
+
+from db import db
+from models import GuestCart
+
+TOKEN_KEY = "guest_cart_token"
+
+
+def store_enabled() -> bool:
+    return bool(current_app.config.get("GUEST_CART_STORE"))
+
+
+def _row() -> GuestCart | None:
+    # Loaded at most once per request (ETag + payload both read the cart).
+    token = session.get(TOKEN_KEY)
+    if not token:
+        return None
+    cached = g.get("guest_cart_row")
+    if cached is None or cached.token != token:
+        cached = db.session.get(GuestCart, token)
+        g.guest_cart_row = cached
+    return cached
+
+
+def load_guest_cart() -> dict:
+    if not store_enabled():
+        return session.get("cart", {})
+    row = _row()
+    if row is None or row.expires_at <= datetime.utcnow():
+        return {}
+    return dict(row.items or {})
+
+
+def guest_cart_version() -> int:
+    if not store_enabled():
+        return session.get("cart_version", 0)
+    row = _row()
+    # An expired row keeps its version so clients never see it go backwards.
+    return row.version if row is not None else 0
+
+
+def save_guest_cart(cart: dict) -> None:
+    """Replace the guest cart. With the server-side store this commits."""
+    if not store_enabled():
+        session["cart"] = cart
+        session["cart_version"] = session.get("cart_version", 0) + 1
+        return
+
+    now = datetime.utcnow()
+    row = _row()
+    if row is None:
+        row = GuestCart(token=secrets.token_urlsafe(32), version=0)
+        db.session.add(row)
+        session[TOKEN_KEY] = row.token
+        g.guest_cart_row = row
+    row.items = dict(cart)
+    row.version = (row.version or 0) + 1
+    row.updated_at = now
+    row.expires_at = now + timedelta(days=current_app.config.get("GUEST_CART_TTL_DAYS", 30))
+    db.session.commit()
+
+
+def clear_guest_cart() -> None:
+    """Drop the guest cart (e.g. after merging it on login). Caller commits."""
+    session.pop("cart", None)
+    session.pop("cart_version", None)
+    token = session.pop(TOKEN_KEY, None)
+    if token:
+        db.session.execute(delete(GuestCart).where(GuestCart.token == token))
+        g.pop("guest_cart_row", None)
+
+
+def purge_expired_guest_carts() -> int:
+    """Delete expired server-side guest carts. Returns rows deleted."""
+    result = db.session.execute(delete(GuestCart).where(GuestCart.expires_at <= datetime.utcnow()))
+    return result.rowcount or 0
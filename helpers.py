@@ -1,4 +1,6 @@
-from flask import jsonify, session
+import hashlib
+
+from flask import g, jsonify, session, request, make_response
 from models import User
 
 def error(code: str, message: str, status: int = 400, details: dict | None = None):
@@ -8,7 +10,35 @@ def error(code: str, message: str, status: int = 400, details: dict | None = Non
     return jsonify(payload), status
 
 def current_user() -> User | None:
+    """Logged-in user, loaded at most once per request (memoized on flask.g)."""
     uid = session.get("user_id")
     if not uid:
         return None
-    return User.query.get(uid)
\ No newline at end of file
+    cached = g.get("_current_user")
+    # keyed by uid so a login/logout within the request is never served stale
+    if cached is None or cached[0] != uid:
+        cached = (uid, User.query.get(uid))
+        g._current_user = cached
+    return cached[1]
+
+def make_etag(*parts) -> str:
+    """Strong ETag value (unquoted) from a cheap version stamp, e.g. ("cart", uid, version)."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+def conditional(etag: str, build, private: bool = True):
+    """
+    Answer If-None-Match with 304 *before* doing the expensive work.
+
+    `build()` is only called on a mismatch; its response gets the ETag and
+    `Cache-Control: no-cache` so clients revalidate on every use.
+    """
+    cache_control = ("private" if private else "public") + ", no-cache"
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(build())
+        if resp.status_code != 200:
+            return resp
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
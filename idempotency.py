@@ -0,0 +1,94 @@
+"""
+Idempotency keys for order creation.
+
+A client sends `Idempotency-Key: <unique string>` with POST /api/orders or
+POST /api/checkout/express. The key is stored in the same transaction as the
+order it created, along with the response. A retry with the same key is
+answered from the stored response without re-running checkout. That covers
+timeouts where the first attempt did commit; the retry would otherwise hit
+"cart is empty" or create a second order.
+
+- Only successful (201) results are stored. A failed attempt commits nothing,
+  so running it again is safe.
+- Reusing a key with a different request body is rejected with 422.
+- Keys expire after IDEMPOTENCY_KEY_TTL_HOURS. Expired keys are removed by:
+  flask --app app.py purge-idempotency-keys
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import delete
+
+from db import db
+from helpers import error
+from models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def idempotency_key():
+    """(key or None, error response or None) from the request headers."""
+    key = (request.headers.get(HEADER) or "").strip()
+    if not key:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        return None, error("validation_error", f"{HEADER} must be at most {MAX_KEY_LENGTH} characters", 400)
+    return key, None
+
+
+def request_fingerprint(payload) -> str:
+    raw = json.dumps([request.method, request.path, payload], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def replay(user_id: int, key: str, fingerprint: str):
+    """Stored response for this key, an error if it was used for another request, or None."""
+    row = db.session.get(IdempotencyKey, (user_id, key))
+    if row is None or row.expires_at <= datetime.utcnow():
+        return None
+    if row.fingerprint != fingerprint:
+        return error(
+            "idempotency_key_reused",
+            f"{HEADER} was already used for a different request",
+            422,
+        )
+    resp = current_app.response_class(
+        current_app.json.dumps(row.response_body), status=row.response_status, mimetype="application/json"
+    )
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def remember(user_id: int, key: str, fingerprint: str, body: dict, status: int, order_id: int | None = None) -> None:
+    """Store the result in the caller's transaction (commit it together with the order)."""
+    now = datetime.utcnow()
+    # An expired row for the same key may still be there; it is simply replaced.
+    db.session.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at <= now,
+        )
+    )
+    db.session.add(
+        IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            fingerprint=fingerprint,
+            order_id=order_id,
+            response_status=status,
+            response_body=body,
+            created_at=now,
+            expires_at=now + timedelta(hours=current_app.config.get("IDEMPOTENCY_KEY_TTL_HOURS", 24)),
+        )
+    )
+
+
+def purge_expired_idempotency_keys() -> int:
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow()))
+    return result.rowcount or 0
@@ -0,0 +1,84 @@
+"""
+Responsive product image derivatives.
+
+`flask --app app.py build-images` resizes each product's source image to a few
+fixed widths in WebP and JPEG, writes them under static/images/products/derived/,
+and stores their URLs + dimensions on Product.image_variants. Templates render
+<picture>/srcset from that data (templates/_macros.html).
+
+Derivative filenames contain the source content hash, so unchanged images are
+reused on the next run and the files can be cached forever.
+Requires Pillow (see requirements.txt).
+"""
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+FORMATS = {
+    # format key -> (Pillow format, extension, save options)
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 6}),
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+DERIVED_SUBDIR = "images/products/derived"
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_path(image_url: str | None, static_folder: Path) -> Path | None:
+    """Map a /static/... image_url to its file on disk (remote URLs are skipped)."""
+    if not image_url or not image_url.startswith("/static/"):
+        return None
+    p = (static_folder / image_url[len("/static/"):]).resolve()
+    if static_folder.resolve() not in p.parents or not p.is_file():
+        return None
+    return p
+
+
+def variants_current(variants: dict | None, digest: str, static_folder: Path) -> bool:
+    if not variants or variants.get("hash") != digest:
+        return False
+    for fmt in FORMATS:
+        for v in variants.get(fmt) or []:
+            if not (static_folder / v["url"][len("/static/"):]).is_file():
+                return False
+    return True
+
+
+def build_variants(src: Path, digest: str, static_folder: Path, widths=DERIVATIVE_WIDTHS, force: bool = False) -> dict:
+    """Write the derivatives for one source image and return the variants record."""
+    from PIL import Image, ImageOps
+
+    out_dir = static_folder / DERIVED_SUBDIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        src_w, src_h = im.size
+
+        # Never upscale; fall back to the source width for small images.
+        targets = sorted({w for w in widths if w < src_w} | ({src_w} if src_w <= max(widths) else set()))
+        record: dict = {"hash": digest, "width": src_w, "height": src_h}
+        for key, (pil_format, ext, options) in FORMATS.items():
+            record[key] = []
+            for w in targets:
+                h = max(1, round(src_h * w / src_w))
+                name = f"{src.stem}-{digest[:12]}-{w}.{ext}"
+                dest = out_dir / name
+                # Content-addressed: another product with the same image reuses the file.
+                if force or not dest.is_file():
+                    im.resize((w, h), Image.LANCZOS).save(dest, pil_format, **options)
+                record[key].append({"url": f"/static/{DERIVED_SUBDIR}/{name}", "width": w, "height": h})
+    return record
+
+
+def srcset(variants: list[dict] | None) -> str:
+    """Jinja filter: [{"url", "width"}, ...] -> "url 320w, url 640w"."""
+    return ", ".join(f'{v["url"]} {v["width"]}w' for v in (variants or []))
@@ -0,0 +1,271 @@
+"""
+Background jobs for work that should not hold up a request (order
+confirmation email, ...).
+
+A job is a row in the `jobs` table, added in the caller's transaction:
+
+    enqueue("send_order_confirmation", {"order_id": order.id})
+
+It is therefore only visible to workers once that transaction commits, is
+dropped with it on rollback, and survives restarts. Handlers are registered
+with @job("name") and receive the JSON payload.
+
+Workers claim a due job with a conditional UPDATE (status queued -> running),
+so any number of threads or processes can poll the same table without running
+a job twice. A handler that raises is retried with exponential backoff
+(JOB_RETRY_BASE_SECONDS * 2**(attempt - 1), capped at JOB_RETRY_MAX_SECONDS)
+until JOB_MAX_ATTEMPTS, then left as failed with its last error. A job still
+"running" JOB_LOCK_TIMEOUT seconds after it was claimed (worker died) is
+queued again. Handlers should therefore be safe to run more than once
+(emails pass a per-message key to mailer.send_email, which sends it only once).
+
+Two ways to run them:
+- In the web process (JOBS_IN_PROCESS=1, the default): a JobRunner thread pool
+  starts with the first request and is woken by every commit that enqueued a job.
+- As a separate worker: flask --app app.py run-jobs [--workers N] [--once]
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from db import db
+from models import Job
+
+log = logging.getLogger(__name__)
+
+HANDLERS: dict[str, Callable[[dict], None]] = {}
+MAX_ERROR_LENGTH = 2000
+
+
+def job(name: str):
+    """Register a handler: @job("send_order_confirmation") def handler(payload): ..."""
+    def register(fn):
+        HANDLERS[name] = fn
+        return fn
+    return register
+
+
+def enqueue(name: str, payload: dict | None = None, delay: float = 0, max_attempts: int | None = None) -> Job:
+    """Add a job in the caller's transaction; it runs after that transaction commits."""
+    if name not in HANDLERS:
+        raise ValueError(f"no handler registered for job {name!r}")
+    row = Job(
+        name=name,
+        payload=payload or {},
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts or current_app.config.get("JOB_MAX_ATTEMPTS", 5),
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(row)
+    db.session.info["jobs_enqueued"] = True
+    return row
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next try after `attempts` failed ones."""
+    base = current_app.config.get("JOB_RETRY_BASE_SECONDS", 10)
+    cap = current_app.config.get("JOB_RETRY_MAX_SECONDS", 3600)
+    return min(cap, base * 2 ** max(0, attempts - 1))
+
+
+def claim_due_jobs(limit: int) -> list[int]:
+    """
+    Mark up to `limit` due jobs as running and return their ids (commits).
+
+    Each claim is `UPDATE jobs SET status = 'running' ... WHERE id = :id AND
+    status = 'queued'`; a job another worker got to first updates no row and
+    is skipped. No row locks, so it behaves the same on SQLite and PostgreSQL.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config.get("JOB_LOCK_TIMEOUT", 300))
+    db.session.execute(
+        update(Job)
+        .where(Job.status == "running", Job.locked_at < stale)
+        .values(status="queued", locked_at=None)
+    )
+
+    candidates = (
+        db.session.query(Job.id)
+        .filter(Job.status == "queued", Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(limit * 2)
+        .all()
+    )
+    claimed = []
+    for (job_id,) in candidates:
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", locked_at=now, attempts=Job.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+            if len(claimed) >= limit:
+                break
+    db.session.commit()
+    return claimed
+
+
+def run_job(job_id: int) -> bool:
+    """Run one claimed job and record the outcome (commits). False if it raised."""
+    row = db.session.get(Job, job_id)
+    if row is None or row.status != "running":
+        return False
+    name, payload = row.name, dict(row.payload or {})
+    try:
+        handler = HANDLERS.get(name)
+        if handler is None:
+            raise LookupError(f"no handler registered for job {name!r}")
+        handler(payload)
+    except Exception as exc:
+        db.session.rollback()
+        row = db.session.get(Job, job_id)
+        row.last_error = f"{type(exc).__name__}: {exc}"[:MAX_ERROR_LENGTH]
+        row.locked_at = None
+        if row.attempts >= row.max_attempts:
+            row.status = "failed"
+            row.finished_at = datetime.utcnow()
+            log.error("job %s (%s) failed after %s attempts: %s", job_id, name, row.attempts, row.last_error)
+        else:
+            row.status = "queued"
+            row.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(row.attempts))
+            log.warning("job %s (%s) attempt %s failed, retrying at %s: %s",
+                        job_id, name, row.attempts, row.run_at, row.last_error)
+        db.session.commit()
+        return False
+
+    row = db.session.get(Job, job_id)
+    row.status = "done"
+    row.locked_at = None
+    row.last_error = None
+    row.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def run_pending(limit: int | None = None) -> dict:
+    """Run every job that is due now, one at a time, in this thread. Returns counts."""
+    stats = {"done": 0, "errors": 0}
+    while limit is None or stats["done"] + stats["errors"] < limit:
+        ids = claim_due_jobs(1)
+        if not ids:
+            break
+        stats["done" if run_job(ids[0]) else "errors"] += 1
+    return stats
+
+
+class JobRunner:
+    """
+    Poller thread + thread pool. The poller claims as many due jobs as there
+    are idle workers, then sleeps for `poll_interval` or until wake() is called.
+    """
+
+    def __init__(self, app, workers: int = 2, poll_interval: float = 2.0):
+        self.app = app
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._thread: threading.Thread | None = None
+        self._pool: ThreadPoolExecutor | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="jobs")
+            self._thread = threading.Thread(target=self._poll, name="jobs-poller", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self, wait: bool = True) -> None:
+        with self._lock:
+            thread, pool = self._thread, self._pool
+            self._thread = self._pool = None
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join()
+        pool.shutdown(wait=wait)
+
+    def _poll(self) -> None:
+        pool = self._pool
+        while not self._stop.is_set():
+            # cleared before claiming, so a wake() during the claim is not lost
+            self._wake.clear()
+            with self._lock:
+                idle = self.workers - self._busy
+            claimed = []
+            if idle > 0:
+                try:
+                    with self.app.app_context():
+                        claimed = claim_due_jobs(idle)
+                except Exception:
+                    log.exception("could not claim jobs")
+            for job_id in claimed:
+                with self._lock:
+                    self._busy += 1
+                pool.submit(self._run, job_id)
+            if len(claimed) < idle or idle == 0:
+                self._wake.wait(self.poll_interval)
+
+    def _run(self, job_id: int) -> None:
+        try:
+            with self.app.app_context():
+                run_job(job_id)
+        except Exception:
+            log.exception("job %s crashed the worker", job_id)
+        finally:
+            with self._lock:
+                self._busy -= 1
+            self._wake.set()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_runner_on_commit(session):
+    if session.info.pop("jobs_enqueued", False) and has_app_context():
+        runner = current_app.extensions.get("job_runner")
+        if runner is not None and runner.running:
+            runner.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("jobs_enqueued", None)
+
+
+# --- Flask integration ---
+
+def init_jobs(app) -> None:
+    runner = JobRunner(
+        app,
+        workers=app.config.get("JOB_WORKERS", 2),
+        poll_interval=app.config.get("JOB_POLL_INTERVAL", 2.0),
+    )
+    app.extensions["job_runner"] = runner
+
+    # Started by the first request rather than here, so CLI commands (init-db,
+    # run-jobs, ...) and tests do not spawn pollers.
+    @app.before_request
+    def _start_job_runner():
+        if not runner.running and app.config.get("JOBS_IN_PROCESS") and not app.testing:
+            runner.start()
@@ -0,0 +1,63 @@
+"""
+Outgoing email.
+
+There is no mail provider yet, so send_email writes each message as an .eml
+file into MAIL_OUTBOX_DIR (default: <instance folder>/outbox). Any mail client
+opens them. Swap this function for a real transport later. Callers send
+from background jobs (jobs.py), so a slow provider never holds up a request.
+"""
+from __future__ import annotations
+
+import os
+import uuid
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from pathlib import Path
+
+from flask import current_app
+
+
+def outbox_dir() -> Path:
+    configured = current_app.config.get("MAIL_OUTBOX_DIR")
+    return Path(configured) if configured else Path(current_app.instance_path) / "outbox"
+
+
+def send_email(to: str, subject: str, body: str, key: str | None = None) -> Path:
+    """
+    Write the message to the outbox and return its path.
+
+    `key` makes the send idempotent: the file is named after it, and a message
+    whose key is already in the outbox is not written again. Background jobs can
+    run more than once, so they should always pass one (a real transport would
+    use it as the provider's idempotency key).
+    """
+    outbox = outbox_dir()
+    outbox.mkdir(parents=True, exist_ok=True)
+    if key:
+        path = outbox / f"{key}.eml"
+        if path.exists():
+            return path
+    else:
+        path = outbox / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.eml"
+
+    msg = EmailMessage()
+    msg["From"] = current_app.config.get("MAIL_FROM", "orders@boxedwithlove.local")
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Date"] = format_datetime(datetime.now().astimezone())
+    msg["Message-ID"] = f"<{key}@boxedwithlove.local>" if key else make_msgid(domain="boxedwithlove.local")
+    msg.set_content(body)
+
+    # Write to a temp file, then link it into place: a reader never sees a
+    # half-written message, and of two concurrent sends with the same key
+    # only the first lands.
+    tmp = outbox / f".{uuid.uuid4().hex}.tmp"
+    tmp.write_bytes(bytes(msg))
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        tmp.unlink()
+    return path
@@ -11,6 +11,8 @@ class User(db.Model):
     last_name = db.Column(db.String(100), nullable=False)
     phone_number = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped on every cart mutation; used as a cheap cart version stamp (ETags etc).
+    cart_version = db.Column(db.Integer, nullable=False, default=0)
 
     addresses = db.relationship(
         "Address",
@@ -44,13 +46,42 @@ class Product(db.Model):
     description = db.Column(db.Text, nullable=False)
     price_cents = db.Column(db.Integer, nullable=False)
     image_url = db.Column(db.String(500), nullable=True)
+    # Resized WebP/JPEG derivatives of image_url (see images.py / build-images).
+    image_variants = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     stock = db.Column(db.BigInteger, nullable=False, default=0)
     is_available = db.Column(db.Boolean, nullable=False, default=True)
 
+    # Denormalized review aggregates, maintained in the same transaction as each
+    # review insert (see ratings.py). Rebuild with: flask --app app.py rebuild-ratings
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_avg = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+
     category_id = db.Column(db.Integer, db.ForeignKey("categories.id"))
     category = db.relationship("Category", back_populates="products")
     reviews = db.relationship("Review", back_populates="product", cascade="all, delete-orphan")
+    popularity = db.relationship("ProductPopularity", uselist=False, lazy="select", viewonly=True)
+
+    @property
+    def rating_histogram(self) -> dict:
+        """Review counts per star rating, e.g. {"1": 0, ..., "5": 12}."""
+        return {str(star): int(getattr(self, f"rating_{star}") or 0) for star in range(1, 6)}
+
+
+class ProductPopularity(db.Model):
+    """Precomputed sales rank for sort=popular (see popularity.py)."""
+    __tablename__ = "product_popularity"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), primary_key=True)
+    # Time-decayed units sold, stored relative to a fixed epoch so rows never need re-decaying.
+    score = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 
 class CartItem(db.Model):
@@ -68,13 +99,74 @@ class CartItem(db.Model):
     )
 
 
+class CatalogVersion(db.Model):
+    """Single row (id=1): shared catalog version behind cache keys and ETags (see cache.py)."""
+    __tablename__ = "catalog_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
+class GuestCart(db.Model):
+    """Server-side guest cart, keyed by an opaque token in the session (see guest_cart.py)."""
+    __tablename__ = "guest_carts"
+    token = db.Column(db.String(64), primary_key=True)
+    # {product_id (str): quantity}, same shape as the cookie-backed cart
+    items = db.Column(db.JSON, nullable=False, default=dict)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Job(db.Model):
+    """Background job, run by a worker after the enqueuing transaction commits (see jobs.py)."""
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # queued -> running -> done; back to queued (later run_at) on error, failed after max_attempts
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # set when a worker claims the job; a stale value means the worker died mid-run
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # workers poll "status = 'queued' AND run_at <= now ORDER BY run_at"
+    __table_args__ = (db.Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+
+class IdempotencyKey(db.Model):
+    """Stored result of a POST made with an Idempotency-Key header (see idempotency.py)."""
+    __tablename__ = "idempotency_keys"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    # sha256 of method + path + JSON body; a reused key with a different request is rejected
+    fingerprint = db.Column(db.String(64), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=True)
+    response_status = db.Column(db.Integer, nullable=False)
+    response_body = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class Order(db.Model):
     __tablename__ = "orders"
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     total_cents = db.Column(db.Integer, nullable=False, default=0)
     status = db.Column(db.String(32), nullable=False, default="placed")
+    # Summary written at creation so order history reads only this table (NULL on
+    # orders from before these columns; fill with: flask --app app.py backfill-order-summaries)
+    subtotal_cents = db.Column(db.Integer, nullable=True)
+    tax_cents = db.Column(db.Integer, nullable=True)
+    item_count = db.Column(db.Integer, nullable=True)
+    # {"names": [first two product names], "more_count": int, "image_url": str | None}
+    preview = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     items = db.relationship(
         "OrderItem",
         backref="order_parent",
@@ -82,6 +174,11 @@ class Order(db.Model):
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (
+        # Keyset-paginated order history (see routes/orders.order_page).
+        db.Index("ix_orders_user_id_id", "user_id", "id"),
+    )
+
 
 class OrderItem(db.Model):
     __tablename__ = "order_items"
@@ -109,6 +206,11 @@ class Review(db.Model):
     user = db.relationship("User", lazy="joined")
     product = db.relationship("Product", back_populates="reviews", lazy="joined")
 
+    __table_args__ = (
+        # Keyset pagination of a product's reviews (newest first).
+        db.Index("ix_reviews_product_created_id", "product_id", "created_at", "id"),
+    )
+
 
 class PaymentMethod(db.Model):
     __tablename__ = "payment_methods"
@@ -0,0 +1,120 @@
+"""
+Keyset (cursor) pagination helpers shared by the list endpoints.
+
+A cursor is an opaque, URL-safe token wrapping the sort key of the last row
+a client has seen. Seeking past it with a WHERE clause keeps every page as
+cheap as the first one (no OFFSET scan).
+"""
+from __future__ import annotations
+
+import base64
+import json
+import math
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from db import db
+
+# Upper bound for the bounded "estimate" count on databases without planner stats.
+ESTIMATE_CAP = 1000
+# Integer cursor values outside BIGINT would overflow in the comparison.
+INT64_MIN, INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    raise TypeError(f"cannot encode {type(value).__name__} in cursor")
+
+
+def _json_hook(obj: dict):
+    if set(obj) == {"$dt"}:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":"), default=_json_default).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> dict:
+    """Decode a cursor token. Raises ValueError for anything malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")), object_hook=_json_hook)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("invalid cursor")
+    return data
+
+
+def _valid_key_value(col, value) -> bool:
+    """Does a decoded cursor value fit the sort column's type (so the comparison cannot fail in SQL)?"""
+    try:
+        expected = col.type.python_type
+    except NotImplementedError:
+        return isinstance(value, (int, float, str, datetime)) and not isinstance(value, bool)
+    if isinstance(value, bool):
+        return expected is bool
+    if expected is int:
+        return isinstance(value, int) and INT64_MIN <= value <= INT64_MAX
+    if expected is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, expected)
+
+
+def keyset_after(keys: list[tuple], values: list):
+    """
+    WHERE clause selecting rows strictly after `values` in the ordering `keys`.
+
+    keys: [(column, "asc" | "desc"[, getter]), ...] — the last key must be unique (e.g. id).
+    Raises ValueError("invalid cursor") unless `values` is a list with one value
+    of the column's type per key (cursors come from clients).
+    Builds (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... which works on every dialect,
+    including mixed asc/desc orderings.
+    """
+    if not isinstance(values, list) or len(keys) != len(values):
+        raise ValueError("invalid cursor")
+    for (col, *_), value in zip(keys, values):
+        if not _valid_key_value(col, value):
+            raise ValueError("invalid cursor")
+
+    clauses = []
+    for i, (col, direction, *_) in enumerate(keys):
+        equal_prefix = [keys[j][0] == values[j] for j in range(i)]
+        step = col > values[i] if direction == "asc" else col < values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def keyset_order_by(keys: list[tuple]) -> list:
+    return [col.asc() if direction == "asc" else col.desc() for col, direction, *_ in keys]
+
+
+def keyset_values(row, keys: list[tuple]) -> list:
+    """Sort key of `row`; keys on SQL expressions pass a getter as the third item."""
+    return [getter[0](row) if getter else getattr(row, col.key) for col, _, *getter in keys]
+
+
+def estimate_count(q) -> int:
+    """
+    Cheap row estimate for a query.
+
+    PostgreSQL: the planner's row estimate (EXPLAIN, no execution).
+    Others: a count bounded at ESTIMATE_CAP rows.
+    """
+    bind = db.session.get_bind()
+    if bind.dialect.name == "postgresql":
+        compiled = q.order_by(None).statement.compile(dialect=bind.dialect)
+        plan = (
+            db.session.connection()
+            .exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params)
+            .scalar()
+        )
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return q.order_by(None).limit(ESTIMATE_CAP).count()
@@ -0,0 +1,90 @@
+"""
+Sales-based popularity ranking for sort=popular.
+
+Each unit sold adds 2 ** ((sold_at - EPOCH) / half_life) to the product's score.
+Newer sales weigh exponentially more, and because every score is measured
+against the same fixed EPOCH the ordering matches a decayed score without ever
+rewriting old rows. Scores are updated in the order transaction (record_sales)
+and can be recomputed from order history with: flask --app app.py rebuild-popularity
+
+Sales do not bump the catalog version. Cached sort=popular listings are keyed
+by ranking_epoch() instead, so they pick up new scores within
+POPULARITY_REFRESH_SECONDS.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, insert
+
+from config import Config
+from db import db, upsert
+from models import Order, OrderItem, ProductPopularity
+
+EPOCH = datetime(2026, 1, 1)
+
+
+def sale_weight(sold_at: datetime) -> float:
+    half_life_seconds = Config.POPULARITY_HALF_LIFE_DAYS * 86400
+    return 2.0 ** ((sold_at - EPOCH).total_seconds() / half_life_seconds)
+
+
+def ranking_epoch() -> int:
+    """Index of the current POPULARITY_REFRESH_SECONDS window (sort=popular cache keys and ETags)."""
+    return int(time.time() // Config.POPULARITY_REFRESH_SECONDS)
+
+
+def record_sales(lines, sold_at: datetime) -> None:
+    """
+    Add an order's lines [(product_id, quantity), ...] to the rank table.
+    Cancellations pass negative quantities with the original order time.
+
+    One multi-row INSERT ... ON CONFLICT DO UPDATE (db.upsert), in the caller's
+    transaction.
+    """
+    units: dict[int, int] = {}
+    for product_id, qty in lines:
+        units[int(product_id)] = units.get(int(product_id), 0) + int(qty)
+    units = {pid: qty for pid, qty in units.items() if qty}
+    if not units:
+        return
+
+    weight = sale_weight(sold_at)
+    upsert(
+        ProductPopularity,
+        [
+            {"product_id": pid, "score": weight * qty, "units_sold": qty, "updated_at": sold_at}
+            for pid, qty in sorted(units.items())
+        ],
+        index_elements=[ProductPopularity.product_id],
+        add=("score", "units_sold"),
+        replace=("updated_at",),
+    )
+
+
+def rebuild_popularity() -> int:
+    """Recompute every score from non-cancelled orders. Returns products ranked."""
+    scores: dict[int, list] = {}
+    rows = (
+        db.session.query(OrderItem.product_id, OrderItem.quantity, Order.created_at)
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.status != "cancelled")
+        .yield_per(1000)
+    )
+    for product_id, qty, created_at in rows:
+        entry = scores.setdefault(int(product_id), [0.0, 0])
+        entry[0] += sale_weight(created_at) * int(qty)
+        entry[1] += int(qty)
+
+    now = datetime.utcnow()
+    db.session.execute(delete(ProductPopularity))
+    if scores:
+        db.session.execute(
+            insert(ProductPopularity),
+            [
+                {"product_id": pid, "score": score, "units_sold": units, "updated_at": now}
+                for pid, (score, units) in scores.items()
+            ],
+        )
+    return len(scores)
@@ -0,0 +1,76 @@
+"""
+Denormalized rating aggregates on Product (sum, count, avg, 1-5 histogram).
+
+Reads (listing, detail, sort=top_rated) use the stored columns directly, so no
+request has to run AVG/COUNT over reviews.
+"""
+from __future__ import annotations
+
+from sqlalchemy import case, update
+
+from db import db
+from models import Product, Review
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def record_review(product_id: int, rating: int) -> None:
+    """
+    Apply one new review to the product's aggregates.
+
+    Call before committing the Review so both land in the same transaction.
+    A single UPDATE with column arithmetic, so concurrent reviews don't lose counts.
+    """
+    histogram_col = getattr(Product, f"rating_{int(rating)}")
+    stmt = (
+        update(Product)
+        .where(Product.id == product_id)
+        .values(
+            {
+                Product.rating_sum: Product.rating_sum + rating,
+                Product.rating_count: Product.rating_count + 1,
+                # SET expressions see the pre-update values on SQLite and Postgres.
+                Product.rating_avg: db.cast(Product.rating_sum + rating, db.Float) / (Product.rating_count + 1),
+                histogram_col: histogram_col + 1,
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(stmt)
+
+
+def rebuild_rating_aggregates() -> int:
+    """Recompute all product aggregates from the reviews table. Returns products updated."""
+    rows = (
+        db.session.query(
+            Review.product_id,
+            db.func.sum(Review.rating),
+            db.func.count(Review.id),
+            *[db.func.sum(case((Review.rating == star, 1), else_=0)) for star in STARS],
+        )
+        .group_by(Review.product_id)
+        .all()
+    )
+
+    zeroed = {"rating_sum": 0, "rating_count": 0, "rating_avg": 0.0}
+    zeroed.update({f"rating_{star}": 0 for star in STARS})
+    db.session.execute(
+        update(Product).values(**zeroed).execution_options(synchronize_session=False)
+    )
+
+    params = []
+    for product_id, total, count, *hist in rows:
+        total, count = int(total or 0), int(count or 0)
+        values = {
+            "id": int(product_id),
+            "rating_sum": total,
+            "rating_count": count,
+            "rating_avg": (total / count) if count else 0.0,
+        }
+        values.update({f"rating_{star}": int(n or 0) for star, n in zip(STARS, hist)})
+        params.append(values)
+
+    if params:
+        # ORM bulk UPDATE by primary key (executemany).
+        db.session.execute(update(Product), params)
+    return len(params)
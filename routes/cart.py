@@ -1,22 +1,133 @@
 from flask import Blueprint, jsonify, request, session
-from db import db
-from models import Product, CartItem
+from sqlalchemy import delete, update
+from db import db, upsert
+from models import Product, CartItem, User
+from helpers import conditional, make_etag
+from cache import catalog_version
+from guest_cart import guest_cart_version, load_guest_cart, save_guest_cart
 
 bp = Blueprint("cart", __name__)
 
 # for users who arent logged in yet, get the cart items from the session
+# (or the server-side guest cart store when GUEST_CART_STORE is on, see guest_cart.py)
 def get_session_cart():
-    return session.get("cart", {})
+    return load_guest_cart()
 
-# save cart items to session
+# save guest cart items (every save is a cart change, so it bumps the guest cart version)
 def set_session_cart(cart_data):
-    session["cart"] = cart_data
+    save_guest_cart(cart_data)
+
+# cart version, bumped on every cart change (same transaction for logged in users).
+# clients compare it to skip re-fetching a cart they already have
+def get_cart_version(user_id):
+    if not user_id:
+        return guest_cart_version()
+    return db.session.query(User.cart_version).filter(User.id == user_id).scalar() or 0
+
+def bump_cart_version(user_id):
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(cart_version=User.cart_version + 1)
+    )
+
+# INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE for one or more cart lines, so
+# concurrent adds neither lose updates nor trip uq_cart_user_product (db.upsert).
+# replace=True sets the quantity instead of adding to it
+def cart_upsert(rows, replace=False, returning=None):
+    return upsert(
+        CartItem,
+        rows,
+        index_elements=[CartItem.user_id, CartItem.product_id],
+        add=() if replace else ("quantity",),
+        replace=("quantity",) if replace else (),
+        returning=returning,
+    )
+
+# add quantity to a cart line in one statement, returns the line's new quantity
+def upsert_cart_item(user_id, product_id, quantity, replace=False):
+    rows = cart_upsert(
+        [{"user_id": user_id, "product_id": product_id, "quantity": quantity}], replace, returning=[CartItem.quantity]
+    )
+    return rows[0].quantity
+
+# add many (product_id, quantity) lines to a user's cart: products checked in one IN query,
+# then one multi-row upsert. used by the login merge and "shop again". caller commits.
+# returns (quantity added, lines skipped because the product no longer exists)
+def add_lines_to_cart(user_id, lines):
+    wanted = {}
+    skipped = 0
+    for product_id, quantity in lines:
+        quantity = int(quantity or 0)
+        if quantity < 1:
+            continue
+        if not str(product_id).isdigit():
+            skipped += 1
+            continue
+        wanted.setdefault(int(product_id), []).append(quantity)
+    if not wanted:
+        return 0, skipped
+
+    found = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(wanted))}
+    rows = []
+    for product_id, quantities in sorted(wanted.items()):
+        if product_id in found:
+            rows.append({"user_id": user_id, "product_id": product_id, "quantity": sum(quantities)})
+        else:
+            skipped += len(quantities)
+    if not rows:
+        return 0, skipped
+
+    cart_upsert(rows)
+    bump_cart_version(user_id)
+    return sum(row["quantity"] for row in rows), skipped
+
+# navbar badge count. for logged in users it is cached in the session keyed by
+# (user id, cart version), and the version comes from the already-loaded User row,
+# so rendering a page costs no cart query unless the cart changed
+def nav_cart_count(user):
+    if not user:
+        return sum(get_session_cart().values())
+    key = [user.id, user.cart_version or 0]
+    cached = session.get("nav_cart")
+    if cached and cached[:2] == key:
+        return cached[2]
+    count = int(
+        db.session.query(db.func.coalesce(db.func.sum(CartItem.quantity), 0))
+        .filter(CartItem.user_id == user.id)
+        .scalar()
+        or 0
+    )
+    session["nav_cart"] = key + [count]
+    return count
+
+def cart_etag(user_id):
+    # product names/prices come from the catalog, so its version is part of the stamp too
+    if user_id:
+        return make_etag("cart", user_id, get_cart_version(user_id), catalog_version())
+    # guest carts are already loaded (cookie or one keyed row), so hashing them is cheap
+    return make_etag("cart", None, get_cart_version(None), sorted(get_session_cart().items()), catalog_version())
 
 @bp.get("/cart")
 #get all items in cart, for both loggedin and non logged in users
 def get_cart():
     user_id = session.get("user_id")
-    
+    # 304 if the client already has this version (no cart query needed)
+    return conditional(cart_etag(user_id), lambda: cart_response(user_id))
+
+def cart_response(user_id):
+    return jsonify(cart_payload(user_id))
+
+# mutation responses: always the new cart version, plus the full cart with ?include=cart
+def mutation_response(user_id, body, status=200):
+    if request.args.get("include") == "cart":
+        body["cart"] = cart_payload(user_id)
+        body["cart_version"] = body["cart"]["cart_version"]
+    else:
+        body["cart_version"] = get_cart_version(user_id)
+    return jsonify(body), status
+
+def cart_payload(user_id):
     if user_id:
         # logged in users - get cart info from database
         items = CartItem.query.filter_by(user_id=user_id).all()
@@ -33,11 +144,13 @@ def get_cart():
                 "subtotal_cents": item.product.price_cents * item.quantity
             })
     else:
-        # non logged in, get from session
+        # non logged in, get from session. one IN query for every line
         cart = get_session_cart()
+        ids = [int(pid) for pid in cart if str(pid).isdigit()]
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))} if ids else {}
         cart_items = []
         for product_id_str, quantity in cart.items():
-            product = Product.query.get(int(product_id_str))
+            product = products.get(int(product_id_str)) if str(product_id_str).isdigit() else None
             if product:
                 cart_items.append({
                     "id": f"session_{product_id_str}",
@@ -55,15 +168,16 @@ def get_cart():
     tax = int(subtotal * 0.13)  # 13% tax
     total = subtotal + tax
     
-    return jsonify({
+    return {
         "items": cart_items,
         "summary": {
             "subtotal_cents": subtotal,
             "tax_cents": tax,
             "shipping_cents": 0,
             "total_cents": total
-        }
-    })
+        },
+        "cart_version": get_cart_version(user_id),
+    }
 
 @bp.post("/cart/items")
 # add product to cart
@@ -82,22 +196,123 @@ def add_to_cart():
     user_id = session.get("user_id")
     
     if user_id:
-        # for logged in users - save to database
-        existing = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-        if existing:
-            existing.quantity += quantity
-        else:
-            item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-            db.session.add(item)
+        # for logged in users - save to database (single atomic upsert)
+        new_quantity = upsert_cart_item(user_id, product.id, quantity)
+        bump_cart_version(user_id)
         db.session.commit()
     else:
         # non logged in user - save to session
         cart = get_session_cart()
         cart_key = str(product_id)
-        cart[cart_key] = cart.get(cart_key, 0) + quantity
+        new_quantity = cart.get(cart_key, 0) + quantity
+        cart[cart_key] = new_quantity
         set_session_cart(cart)
     
-    return jsonify({"success": True, "message": "Item added to cart"}), 201
+    return mutation_response(user_id, {"success": True, "message": "Item added to cart", "quantity": new_quantity}, 201)
+
+MAX_BATCH_OPERATIONS = 100
+
+def batch_error(code, message, index=None, status=400):
+    err = {"code": code, "message": message}
+    if index is not None:
+        err["index"] = index
+    return jsonify({"error": err}), status
+
+# validate batch operations and resolve them to (op, product_id, quantity).
+# lines are addressed by product_id, or by the cart item id returned from GET /api/cart
+def parse_batch_operations(user_id, operations):
+    if not isinstance(operations, list) or not operations:
+        return None, batch_error("validation_error", "'operations' must be a non-empty list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return None, batch_error("validation_error", f"at most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    # db cart item ids -> product ids, one query for the whole batch
+    item_ids = set()
+    for op in operations:
+        item_id = str(op.get("item_id", "")) if isinstance(op, dict) else ""
+        if user_id and item_id.isdigit():
+            item_ids.add(int(item_id))
+    item_products = {}
+    if item_ids:
+        item_products = dict(
+            db.session.query(CartItem.id, CartItem.product_id)
+            .filter(CartItem.user_id == user_id, CartItem.id.in_(item_ids))
+            .all()
+        )
+
+    parsed = []
+    for i, op in enumerate(operations):
+        if not isinstance(op, dict) or op.get("op") not in ("add", "set", "remove"):
+            return None, batch_error("validation_error", "'op' must be one of add, set, remove", i)
+        kind = op["op"]
+
+        if op.get("product_id") is not None:
+            product_id = op["product_id"]
+        elif op.get("item_id") is not None and kind != "add":
+            item_id = str(op["item_id"])
+            if item_id.startswith("session_"):
+                product_id = item_id.replace("session_", "")
+            elif item_id.isdigit() and int(item_id) in item_products:
+                product_id = item_products[int(item_id)]
+            else:
+                return None, batch_error("not_found", "Cart item not found", i, 404)
+        else:
+            return None, batch_error("missing_product", "Product ID required", i)
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None, batch_error("validation_error", "'product_id' must be an integer", i)
+
+        quantity = 0
+        if kind != "remove":
+            quantity = op.get("quantity", 1 if kind == "add" else None)
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < (1 if kind == "add" else 0):
+                return None, batch_error("invalid_quantity", "Quantity must be at least 1", i)
+        parsed.append((kind, product_id, quantity))
+
+    # every product referenced by add/set must exist (one IN query)
+    wanted = {pid for kind, pid, _ in parsed if kind != "remove"}
+    if wanted:
+        found = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(wanted))}
+        for i, (kind, pid, _) in enumerate(parsed):
+            if kind != "remove" and pid not in found:
+                return None, batch_error("not_found", "Product not found", i, 404)
+    return parsed, None
+
+@bp.post("/cart/batch")
+# apply an ordered list of add/set/remove operations in one transaction, return the cart.
+# "set" with quantity 0 removes the line
+def batch_cart():
+    data = request.get_json(silent=True) or {}
+    user_id = session.get("user_id")
+
+    operations, err = parse_batch_operations(user_id, data.get("operations"))
+    if err:
+        return err
+
+    if user_id:
+        for kind, product_id, quantity in operations:
+            if kind == "remove" or quantity == 0:
+                db.session.execute(
+                    delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id == product_id)
+                )
+            else:
+                upsert_cart_item(user_id, product_id, quantity, replace=(kind == "set"))
+        bump_cart_version(user_id)
+        db.session.commit()
+    else:
+        cart = dict(get_session_cart())
+        for kind, product_id, quantity in operations:
+            cart_key = str(product_id)
+            if kind == "remove" or quantity == 0:
+                cart.pop(cart_key, None)
+            elif kind == "set":
+                cart[cart_key] = quantity
+            else:
+                cart[cart_key] = cart.get(cart_key, 0) + quantity
+        set_session_cart(cart)
+
+    return cart_response(user_id)
 
 @bp.put("/cart/items/<item_id>")
 # replaces the quanitity of the cart item - PUT
@@ -116,6 +331,7 @@ def update_cart_item(item_id):
         if not item:
             return jsonify({"error": {"code": "not_found", "message": "Cart item not found"}}), 404
         item.quantity = quantity
+        bump_cart_version(user_id)
         db.session.commit()
     else:
         # session
@@ -126,7 +342,7 @@ def update_cart_item(item_id):
         cart[product_id] = quantity
         set_session_cart(cart)
     
-    return jsonify({"success": True, "message": "Cart updated"})
+    return mutation_response(user_id, {"success": True, "message": "Cart updated"})
 
 @bp.patch("/cart/items/<item_id>")
 def partial_update_cart_item(item_id):
@@ -145,6 +361,7 @@ def partial_update_cart_item(item_id):
             return jsonify({"error": {"code": "not_found", "message": "Cart item not found"}}), 404
         if quantity is not None:
             item.quantity = quantity
+        bump_cart_version(user_id)
         db.session.commit()
     else:
         # session
@@ -156,7 +373,7 @@ def partial_update_cart_item(item_id):
             cart[product_id] = quantity
         set_session_cart(cart)
     
-    return jsonify({"success": True, "message": "Cart updated"})
+    return mutation_response(user_id, {"success": True, "message": "Cart updated"})
 
 
 @bp.delete("/cart/items/<item_id>")
@@ -170,6 +387,7 @@ def delete_cart_item(item_id):
         if not item:
             return jsonify({"error": {"code": "not_found", "message": "Cart item not found"}}), 404
         db.session.delete(item)
+        bump_cart_version(user_id)
         db.session.commit()
     else:
         # session cart item
@@ -181,4 +399,4 @@ def delete_cart_item(item_id):
         else:
             return jsonify({"error": {"code": "not_found", "message": "Cart item not found"}}), 404
     
-    return jsonify({"success": True, "message": "Item removed from cart"})
\ No newline at end of file
+    return mutation_response(user_id, {"success": True, "message": "Item removed from cart"})
\ No newline at end of file
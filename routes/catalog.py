@@ -1,13 +1,43 @@
-from flask import Blueprint, request, session
-from sqlalchemy import or_, func
+from flask import Blueprint, current_app, request, session
 
-from models import Product, Category, Review
-from helpers import error
+from models import Product, Category, Review, ProductPopularity
+from helpers import error, conditional, make_etag
 from config import Config
+from search import apply_search
+from ratings import record_review
+from popularity import ranking_epoch
+from cache import cached_payload, catalog_version, get_catalog_cache
+from pagination import (
+    decode_cursor,
+    encode_cursor,
+    estimate_count,
+    keyset_after,
+    keyset_order_by,
+    keyset_values,
+)
 
 from db import db
 bp = Blueprint("catalog_api", __name__)
 
+# Products without sales have no rank row yet.
+POPULARITY_SCORE = db.func.coalesce(ProductPopularity.score, 0.0)
+
+# Keyset orderings for cursor pagination (last key is unique so pages never overlap).
+SORT_KEYS = {
+    "price_asc": [(Product.price_cents, "asc"), (Product.id, "asc")],
+    "price_desc": [(Product.price_cents, "desc"), (Product.id, "asc")],
+    "newest": [(Product.created_at, "desc"), (Product.id, "desc")],
+    "top_rated": [(Product.rating_avg, "desc"), (Product.rating_count, "desc"), (Product.id, "asc")],
+    # Sales rank from the product_popularity table (see popularity.py)
+    "popular": [
+        (POPULARITY_SCORE, "desc", lambda p: p.popularity.score if p.popularity else 0.0),
+        (Product.id, "asc"),
+    ],
+}
+
+TOTAL_MODES = {"exact", "estimate", "none"}
+
+
 @bp.get("/products")
 def list_products():
     try:
@@ -22,37 +52,113 @@ def list_products():
     search = (request.args.get("q") or "").strip()
     category = (request.args.get("category") or "").strip()
     sort = (request.args.get("sort") or "popular").strip()
+    cursor = (request.args.get("cursor") or "").strip()
+    total_mode = (request.args.get("total") or "exact").strip().lower()
+
+    if total_mode not in TOTAL_MODES:
+        return error("validation_error", "total must be one of: exact, estimate, none", 400)
+
+    # Search is case-insensitive, so normalize it in the cache key.
+    key = ("products", search.lower(), category, sort, limit, offset, cursor, total_mode)
+    # Sales do not bump the catalog version; popular rankings (also what unknown
+    # sorts and relevance without a match rank fall back to) are rebuilt once per
+    # POPULARITY_REFRESH_SECONDS window.
+    if sort == "popular" or sort not in SORT_KEYS:
+        key += (ranking_epoch(),)
+    payload, status = cached_payload(
+        key, lambda: product_list_payload(search, category, sort, limit, offset, cursor, total_mode)
+    )
+    if status != 200:
+        return payload, status
+
+    stock = live_stock([p["id"] for p in payload["items"]])
+    return conditional(
+        make_etag(catalog_version(), *key, sorted(stock.items())),
+        lambda: dict(payload, items=[with_stock(p, stock) for p in payload["items"]]),
+        private=False,
+    )
+
+
+def live_stock(product_ids: list[int]) -> dict[int, int]:
+    """
+    Current stock for `product_ids` (one primary-key IN query).
+
+    Every order changes stock, so it is not covered by the catalog version:
+    cached list/detail payloads are reused as they are, and the stock they
+    show (and their ETags) come from this read.
+    """
+    if not product_ids:
+        return {}
+    rows = db.session.query(Product.id, Product.stock).filter(Product.id.in_(product_ids))
+    return {pid: int(stock) for pid, stock in rows}
 
+
+def with_stock(product: dict, stock: dict[int, int]) -> dict:
+    """Copy of a cached product payload with its live stock."""
+    return dict(product, stock=stock.get(product["id"], product["stock"]))
+
+
+def product_list_payload(search: str, category: str, sort: str, limit: int, offset: int, cursor: str, total_mode: str):
+    """Build the /products response body. Returns (payload, status) like a view."""
     q = Product.query
 
-    # Search
+    # Search (full-text index; rank is None when falling back to ILIKE)
+    rank = None
     if search:
-        like = f"%{search}%"
-        q = q.filter(
-            or_(
-                Product.name.ilike(like),
-                Product.description.ilike(like),
-                Product.sku.ilike(like),
-            )
-        )
+        q, rank = apply_search(q, search)
 
     # Category filter (category passed as NAME like "Basket")
     if category:
         q = q.join(Category).filter(Category.category_name == category)
 
+    # Count before the cursor predicate so `total` describes the whole result set.
+    total = None
+    if total_mode == "exact":
+        total = q.count()
+    elif total_mode == "estimate":
+        total = estimate_count(q)
+
     # Sort
-    if sort == "price_asc":
-        q = q.order_by(Product.price_cents.asc())
-    elif sort == "price_desc":
-        q = q.order_by(Product.price_cents.desc())
-    elif sort == "newest":
-        q = q.order_by(Product.created_at.desc())
+    keys = None
+    if sort == "relevance" and rank is not None:
+        q = q.order_by(rank, Product.id.asc())
     else:
-        # "popular" fallback (you can later replace with real popularity)
-        q = q.order_by(Product.id.asc())
+        if sort not in SORT_KEYS:
+            sort = "popular"
+        if sort == "popular":
+            # Load the rank row through the same join used for ordering.
+            q = q.outerjoin(ProductPopularity, ProductPopularity.product_id == Product.id).options(
+                db.contains_eager(Product.popularity)
+            )
+        keys = SORT_KEYS[sort]
+        q = q.order_by(*keyset_order_by(keys))
 
-    total = q.count()
-    items = q.limit(limit).offset(offset).all()
+    # Cursor (keyset) pagination replaces OFFSET when present
+    if cursor:
+        if keys is None:
+            return error("validation_error", "cursor is not supported for sort=relevance", 400)
+        try:
+            data = decode_cursor(cursor)
+            if data.get("sort") != sort:
+                raise ValueError("cursor does not match sort")
+            q = q.filter(keyset_after(keys, data.get("after") or []))
+        except ValueError as ve:
+            return error("validation_error", str(ve), 400)
+        offset = 0
+    else:
+        q = q.offset(offset)
+
+    # Fetch one extra row to learn whether another page exists (no count needed).
+    rows = q.limit(limit + 1).all()
+    items = rows[:limit]
+
+    next_cursor = None
+    if keys is not None and len(rows) > limit:
+        next_cursor = encode_cursor({"sort": sort, "after": keyset_values(items[-1], keys)})
+
+    paging = {"limit": limit, "offset": offset, "total": total, "next_cursor": next_cursor}
+    if total_mode == "estimate":
+        paging["total_is_estimate"] = True
 
     return {
         "items": [
@@ -63,35 +169,203 @@ def list_products():
                 "description": p.description,
                 "price_cents": p.price_cents,
                 "image_url": p.image_url,
+                "image_variants": p.image_variants,
                 "category": p.category.category_name if p.category else None,
                 "stock": p.stock,
                 "is_available": p.is_available,
+                "avg_rating": p.rating_avg,
+                "review_count": p.rating_count,
             }
             for p in items
         ],
-        "paging": {"limit": limit, "offset": offset, "total": total},
+        "paging": paging,
     }, 200
 
 
-@bp.get("/products/<int:product_id>")
-def product_detail(product_id: int):
-    p = Product.query.get(product_id)
-    if not p:
-        return error("not_found", "product not found", 404)
+# Facet buckets: (key, label, min_cents inclusive, max_cents exclusive or None)
+PRICE_BUCKETS = [
+    ("under_25", "Under $25", 0, 2500),
+    ("25_50", "$25 - $50", 2500, 5000),
+    ("50_100", "$50 - $100", 5000, 10000),
+    ("100_plus", "$100+", 10000, None),
+]
+# Cumulative "N stars & up" on the stored average (rated products only).
+RATING_BUCKETS = [4, 3, 2, 1]
 
-    reviews = (
-        Review.query
-        .filter(Review.product_id == product_id)
-        .order_by(Review.created_at.desc(), Review.id.desc())
+
+def _facet_rows(search: str) -> list[tuple]:
+    """
+    Per-category counts (total, price buckets, rating buckets) for `search`,
+    in a single GROUP BY query. Cached by catalog version.
+
+    Categories drive the join, so empty categories are listed with 0 and
+    uncategorized products are not counted.
+    """
+    cache = get_catalog_cache()
+    key = (catalog_version(), "facet_rows", search.lower())
+    rows = cache.get(key)
+    if rows is not None:
+        return rows
+
+    pq = db.session.query(
+        Product.id.label("id"),
+        Product.category_id.label("category_id"),
+        Product.price_cents.label("price_cents"),
+        Product.rating_avg.label("rating_avg"),
+        Product.rating_count.label("rating_count"),
+    )
+    if search:
+        pq, _ = apply_search(pq, search)
+    matched = pq.subquery()
+
+    def bucket(cond):
+        return db.func.coalesce(db.func.sum(db.case((cond, 1), else_=0)), 0)
+
+    price_cols = []
+    for _, _, lo, hi in PRICE_BUCKETS:
+        cond = matched.c.price_cents >= lo
+        if hi is not None:
+            cond = db.and_(cond, matched.c.price_cents < hi)
+        price_cols.append(bucket(cond))
+    rating_cols = [
+        bucket(db.and_(matched.c.rating_count > 0, matched.c.rating_avg >= stars))
+        for stars in RATING_BUCKETS
+    ]
+
+    result = (
+        db.session.query(Category.category_name, db.func.count(matched.c.id), *price_cols, *rating_cols)
+        .outerjoin(matched, matched.c.category_id == Category.id)
+        .group_by(Category.id, Category.category_name)
+        .order_by(Category.category_name.asc())
         .all()
     )
+    rows = [(name, *[int(v or 0) for v in counts]) for name, *counts in result]
+    cache.set(key, rows)
+    return rows
+
+
+def compute_facets(search: str = "", category: str = "") -> dict:
+    """
+    Facet counts for the current search.
+
+    Category counts ignore the selected category (so the other options stay
+    visible); price and rating counts are narrowed to it.
+    """
+    rows = _facet_rows(search)
+    n_price = len(PRICE_BUCKETS)
+    selected = category.lower()
+
+    price = [0] * n_price
+    rating = [0] * len(RATING_BUCKETS)
+    total = 0
+    for name, count, *buckets in rows:
+        if selected and name.lower() != selected:
+            continue
+        total += count
+        price = [a + b for a, b in zip(price, buckets[:n_price])]
+        rating = [a + b for a, b in zip(rating, buckets[n_price:])]
+
+    return {
+        "total": total,
+        "categories": [{"name": name, "count": count} for name, count, *_ in rows],
+        "price": [
+            {"key": key, "label": label, "min_cents": lo, "max_cents": hi, "count": price[i]}
+            for i, (key, label, lo, hi) in enumerate(PRICE_BUCKETS)
+        ],
+        "rating": [
+            {"key": f"{stars}_up", "min_rating": stars, "count": rating[i]}
+            for i, stars in enumerate(RATING_BUCKETS)
+        ],
+    }
 
-    avg_rating = (
-        Review.query.with_entities(func.avg(Review.rating))
+
+@bp.get("/products/facets")
+def product_facets():
+    search = (request.args.get("q") or "").strip()
+    category = (request.args.get("category") or "").strip()
+    return conditional(
+        make_etag(catalog_version(), "facets", search.lower(), category.lower()),
+        lambda: (compute_facets(search, category), 200),
+        private=False,
+    )
+
+
+# Newest first; served by ix_reviews_product_created_id (product_id, created_at, id).
+REVIEW_KEYS = [(Review.created_at, "desc"), (Review.id, "desc")]
+
+
+def review_page(product_id: int, limit: int, cursor: str | None = None, with_user: bool = False):
+    """
+    One page of a product's reviews plus the cursor for the next page.
+
+    Raises ValueError for a bad cursor. The joined Product (and User, unless
+    with_user=True) relationships are not loaded, so each row stays small.
+    """
+    q = (
+        Review.query
+        .options(db.lazyload(Review.product))
         .filter(Review.product_id == product_id)
-        .scalar()
+        .order_by(*keyset_order_by(REVIEW_KEYS))
+    )
+    if not with_user:
+        q = q.options(db.lazyload(Review.user))
+    if cursor:
+        data = decode_cursor(cursor)
+        q = q.filter(keyset_after(REVIEW_KEYS, data.get("after") or []))
+
+    rows = q.limit(limit + 1).all()
+    reviews = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor({"after": keyset_values(reviews[-1], REVIEW_KEYS)})
+    return reviews, next_cursor
+
+
+def review_to_dict(r: Review) -> dict:
+    return {
+        "id": r.id,
+        "user_id": r.user_id,
+        "product_id": r.product_id,
+        "rating": r.rating,
+        "comment": r.comment,
+        "created_at": r.created_at.isoformat() if r.created_at else None,
+    }
+
+
+@bp.get("/products/<int:product_id>")
+def product_detail(product_id: int):
+    key = ("product", product_id)
+    payload, status = cached_payload(key, lambda: product_detail_payload(product_id))
+    if status != 200:
+        return payload, status
+
+    stock = live_stock([product_id])
+    return conditional(
+        make_etag(catalog_version(), *key, stock.get(product_id)),
+        lambda: with_stock(payload, stock),
+        private=False,
     )
-    avg_rating = float(avg_rating) if avg_rating is not None else 0.0
+
+
+@bp.get("/catalog/cache-stats")
+def catalog_cache_stats():
+    """
+    Hit/miss/eviction counters for sizing CATALOG_CACHE_SIZE / CATALOG_CACHE_TTL.
+    Internal; answers 404 unless CATALOG_CACHE_STATS is enabled.
+    """
+    if not current_app.config.get("CATALOG_CACHE_STATS"):
+        return error("not_found", "not found", 404)
+    return {"catalog_version": catalog_version(), "cache": get_catalog_cache().stats()}, 200
+
+
+def product_detail_payload(product_id: int):
+    p = Product.query.get(product_id)
+    if not p:
+        return error("not_found", "product not found", 404)
+
+    # Only the first page is embedded; the rest via /products/<id>/reviews?cursor=
+    limit = Config.REVIEWS_PAGE_SIZE
+    reviews, next_cursor = review_page(product_id, limit)
 
     return {
         "id": p.id,
@@ -100,24 +374,41 @@ def product_detail(product_id: int):
         "description": p.description,
         "price_cents": p.price_cents,
         "image_url": p.image_url,
+        "image_variants": p.image_variants,
         "stock": p.stock,
         "is_available": p.is_available,
         "category": p.category.category_name if p.category else None,
         "reviews_summary": {
-            "avg_rating": avg_rating,
-            "count": len(reviews),
+            "avg_rating": p.rating_avg,
+            "count": p.rating_count,
+            "histogram": p.rating_histogram,
         },
-        "reviews": [
-            {
-                "id": r.id,
-                "user_id": r.user_id,
-                "product_id": r.product_id,
-                "rating": r.rating,
-                "comment": r.comment,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
-            }
-            for r in reviews
-        ],
+        "reviews": [review_to_dict(r) for r in reviews],
+        "reviews_paging": {"limit": limit, "next_cursor": next_cursor},
+    }, 200
+
+
+@bp.get("/products/<int:product_id>/reviews")
+def list_reviews(product_id: int):
+    try:
+        limit = int(request.args.get("limit", Config.REVIEWS_PAGE_SIZE))
+    except ValueError:
+        return error("validation_error", "limit must be an integer", 400)
+    limit = max(1, min(limit, Config.MAX_LIMIT))
+    cursor = (request.args.get("cursor") or "").strip() or None
+
+    # Cheap PK lookup so unknown products 404 instead of returning an empty page.
+    if not db.session.get(Product, product_id):
+        return error("not_found", "product not found", 404)
+
+    try:
+        reviews, next_cursor = review_page(product_id, limit, cursor)
+    except ValueError as ve:
+        return error("validation_error", str(ve), 400)
+
+    return {
+        "items": [review_to_dict(r) for r in reviews],
+        "paging": {"limit": limit, "next_cursor": next_cursor},
     }, 200
 
 @bp.post("/products/<int:product_id>/reviews")
@@ -149,15 +440,7 @@ def add_review(product_id: int):
     )
 
     db.session.add(review)
+    record_review(product_id, rating)
     db.session.commit()
 
-    return {
-        "review": {
-            "id": review.id,
-            "user_id": review.user_id,
-            "product_id": review.product_id,
-            "rating": review.rating,
-            "comment": review.comment,
-            "created_at": review.created_at.isoformat() if review.created_at else None,
-        }
-    }, 201
\ No newline at end of file
+    return {"review": review_to_dict(review)}, 201
\ No newline at end of file
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 from datetime import datetime
-from flask import Blueprint, request, session, make_response
+from flask import Blueprint, current_app, request, session, make_response
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from db import db
-from helpers import error
-from models import Order, OrderItem, CartItem, Product, PaymentMethod
+from helpers import error, conditional, make_etag
+from models import Address, Order, OrderItem, CartItem, PaymentMethod, Product, User
+from routes.cart import get_cart_version
+from checkout import TAX_RATE, cart_snapshot, claim_cart_version, release_stock, reprice, reserve_stock
+from popularity import record_sales
+from cache import catalog_version
+from pagination import decode_cursor, encode_cursor, keyset_after, keyset_order_by, keyset_values
+from idempotency import idempotency_key, remember, replay, request_fingerprint
+from jobs import enqueue, job
+from mailer import send_email
 
 bp = Blueprint("orders_api", __name__)
 
-# Keep totals consistent with the cart module.
-TAX_RATE = 0.13
+# Order history is newest first; with the user_id filter this walks ix_orders_user_id_id.
+ORDER_KEYS = [(Order.id, "desc")]
 
 
 def require_user_id():
@@ -19,6 +29,116 @@ def require_user_id():
     return uid, None
 
 
+def order_page(user_id: int, limit: int, cursor: str | None = None, with_items: bool = False):
+    """
+    One page of a user's orders (newest first) plus the cursor for the next page.
+    with_items loads every line on the page (and its product) in one extra
+    SELECT ... WHERE order_id IN (...). Raises ValueError for a bad cursor.
+    """
+    q = page_query(Order.query, user_id, cursor)
+    if with_items:
+        q = q.options(db.selectinload(Order.items))
+
+    rows = q.limit(limit + 1).all()
+    orders = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor({"after": keyset_values(orders[-1], ORDER_KEYS)})
+    return orders, next_cursor
+
+
+def page_query(q, user_id: int, cursor: str | None):
+    q = q.filter(Order.user_id == user_id).order_by(*keyset_order_by(ORDER_KEYS))
+    if cursor:
+        data = decode_cursor(cursor)
+        q = q.filter(keyset_after(ORDER_KEYS, data.get("after") or []))
+    return q
+
+
+def order_page_stamp(user_id: int, limit: int, cursor: str | None = None) -> list:
+    """
+    Version stamp for one page: (id, updated_at) of the rows order_page would
+    return, plus the first row of the next page (so a next_cursor appearing or
+    going away changes it too). Same index walk as the page, narrow rows only.
+    Raises ValueError for a bad cursor.
+    """
+    return [tuple(r) for r in page_query(db.session.query(Order.id, Order.updated_at), user_id, cursor).limit(limit + 1)]
+
+
+def order_summary(lines) -> dict:
+    """
+    Denormalized Order summary columns from [(name, image_url, quantity), ...] in line order
+    (item count, and a preview of the first two product names plus the first thumbnail).
+    """
+    preview = {"names": [], "more_count": 0, "image_url": None}
+    item_count = 0
+    for name, image_url, quantity in lines:
+        item_count += int(quantity or 0)
+        if not preview["image_url"] and image_url:
+            preview["image_url"] = image_url
+        if name:
+            if len(preview["names"]) < 2:
+                preview["names"].append(name)
+            else:
+                preview["more_count"] += 1
+    return {"item_count": item_count, "preview": preview}
+
+
+def summarize_orders(order_ids) -> dict[int, dict]:
+    """order_summary() for existing orders, from their items (one query)."""
+    rows = (
+        db.session.query(OrderItem.order_id, Product.name, Product.image_url, OrderItem.quantity)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+        .filter(OrderItem.order_id.in_(order_ids))
+        .order_by(OrderItem.order_id, OrderItem.id)
+        .all()
+    )
+    lines: dict[int, list] = {int(oid): [] for oid in order_ids}
+    for oid, name, image_url, quantity in rows:
+        lines[int(oid)].append((name, image_url, quantity))
+    return {oid: order_summary(order_lines) for oid, order_lines in lines.items()}
+
+
+def backfill_order_summaries(batch_size: int = 500) -> int:
+    """
+    Fill the summary columns on orders created before they existed, in batches
+    (bulk UPDATE by primary key). Caller commits. Returns orders updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        orders = (
+            db.session.query(Order.id, Order.total_cents)
+            .filter(Order.item_count.is_(None), Order.id > last_id)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not orders:
+            return updated
+        last_id = orders[-1].id
+
+        ids = [o.id for o in orders]
+        subtotals = dict(
+            db.session.query(OrderItem.order_id, db.func.sum(OrderItem.unit_price_cents * OrderItem.quantity))
+            .filter(OrderItem.order_id.in_(ids))
+            .group_by(OrderItem.order_id)
+            .all()
+        )
+        summaries = summarize_orders(ids)
+
+        rows = []
+        for oid, total in orders:
+            subtotal = int(subtotals.get(oid) or 0)
+            # same rule the order page used to derive tax from the stored total
+            tax = int(total or 0) - subtotal
+            if not total or tax < 0:
+                tax = int(subtotal * TAX_RATE)
+            rows.append({"id": oid, "subtotal_cents": subtotal, "tax_cents": tax, **summaries[oid]})
+        db.session.execute(update(Order), rows)
+        updated += len(rows)
+
+
 def order_to_dict(order: Order, include_items: bool = False) -> dict:
     data = {
         "id": order.id,
@@ -42,6 +162,20 @@ def order_to_dict(order: Order, include_items: bool = False) -> dict:
     return data
 
 
+@job("send_order_confirmation")
+def send_order_confirmation(payload: dict) -> None:
+    """Email the receipt for a placed order (background job)."""
+    order = db.session.get(Order, payload["order_id"])
+    if order is None:
+        return
+    user = db.session.get(User, order.user_id)
+    # Rendered straight from the Jinja environment: jobs run without a request,
+    # and the app's context processors (nav user, cart count) read the session.
+    body = current_app.jinja_env.get_template("emails/order_confirmation.txt").render(order=order, user=user)
+    # keyed by order, so a job that runs twice (requeued after a timeout) sends one email
+    send_email(user.email, f"Your BoxedWithLove order #{order.id}", body, key=f"order-{order.id}-confirmation")
+
+
 def ensure_payment_method(uid: int, payment_method_id: int | None):
     """
     Checkout must be associated with a payment method for the user.
@@ -72,12 +206,37 @@ def list_orders():
     if err:
         return err
 
-    orders = (
-        Order.query.filter_by(user_id=uid)
-        .order_by(Order.id.desc())
-        .all()
-    )
-    return {"items": [order_to_dict(o, include_items=False) for o in orders]}, 200
+    try:
+        limit = int(request.args.get("limit", current_app.config["ORDERS_PAGE_SIZE"]))
+    except ValueError:
+        return error("validation_error", "limit must be an integer", 400)
+    limit = max(1, min(limit, current_app.config["MAX_LIMIT"]))
+    cursor = (request.args.get("cursor") or "").strip() or None
+    include = {part.strip() for part in (request.args.get("include") or "").split(",") if part.strip()}
+    if include - {"items"}:
+        return error("validation_error", "include supports only 'items'", 400)
+    with_items = "items" in include
+
+    # Version stamp from the visible page only: a new order or a status change
+    # on it (updated_at) changes the rows read here. Embedded items show
+    # product names, so they also depend on the catalog version.
+    try:
+        stamp = order_page_stamp(uid, limit, cursor)
+    except ValueError as ve:
+        return error("validation_error", str(ve), 400)
+    etag = make_etag("orders", uid, stamp, limit, cursor, with_items, catalog_version() if with_items else None)
+
+    def build():
+        try:
+            orders, next_cursor = order_page(uid, limit, cursor, with_items=with_items)
+        except ValueError as ve:
+            return error("validation_error", str(ve), 400)
+        return {
+            "items": [order_to_dict(o, include_items=with_items) for o in orders],
+            "paging": {"limit": limit, "next_cursor": next_cursor},
+        }, 200
+
+    return conditional(etag, build)
 
 
 @bp.route("/orders/<int:order_id>", methods=["GET"], provide_automatic_options=False)
@@ -86,91 +245,142 @@ def get_order(order_id: int):
     if err:
         return err
 
-    order = Order.query.filter_by(id=order_id, user_id=uid).first()
-    if not order:
+    # Only the timestamp first; items (joined with products) are loaded on a mismatch.
+    updated_at = (
+        db.session.query(Order.updated_at)
+        .filter(Order.id == order_id, Order.user_id == uid)
+        .scalar()
+    )
+    if updated_at is None:
         return error("not_found", "order not found", 404)
 
-    # Ensure items relationship is loaded
-    _ = order.items
-    return order_to_dict(order, include_items=True), 200
+    def build():
+        order = Order.query.filter_by(id=order_id, user_id=uid).first()
+        # Ensure items relationship is loaded
+        _ = order.items
+        return order_to_dict(order, include_items=True), 200
 
+    return conditional(make_etag("order", uid, order_id, updated_at), build)
 
-@bp.route("/orders", methods=["POST"], provide_automatic_options=False)
-def create_order():
-    """
-    Checkout:
-    - requires logged-in user
-    - requires payment method (explicit id OR default OR any)
-    - converts user's CartItem rows -> Order + OrderItems
-    - clears cart
-    """
-    uid, err = require_user_id()
-    if err:
-        return err
 
-    payload = request.get_json(silent=True) or {}
+def payment_method_from_payload(uid: int, payload: dict):
     payment_method_id = payload.get("payment_method_id")
     if payment_method_id is not None:
         try:
             payment_method_id = int(payment_method_id)
         except Exception:
-            return error("validation_error", "payment_method_id must be an integer", 400)
+            return None, error("validation_error", "payment_method_id must be an integer", 400)
+    return ensure_payment_method(uid, payment_method_id)
 
-    pm, err = ensure_payment_method(uid, payment_method_id)
-    if err:
-        return err
 
-    cart_items = CartItem.query.filter_by(user_id=uid).all()
-    if not cart_items:
+def place_order(uid: int, pm: PaymentMethod, cart_version=None, new_address: Address | None = None,
+                idempotency: tuple[str, str] | None = None, shipping: dict | None = None):
+    """
+    Turn the user's cart into an order in one transaction (shared by POST /orders
+    and POST /checkout/express). `new_address` is saved in the same transaction,
+    and so is the response when an Idempotency-Key (key, fingerprint) was sent.
+    `shipping` is echoed back in the response.
+    """
+    # The cart is priced once per cart version (checkout.py); clients that showed the
+    # user a review page pass the version they showed, so a cart edited since then is refused.
+    current_version = get_cart_version(uid)
+    if cart_version is None:
+        cart_version = current_version
+    if not isinstance(cart_version, int) or isinstance(cart_version, bool):
+        return error("validation_error", "cart_version must be an integer", 400)
+    if cart_version != current_version:
+        return error("cart_changed", "cart changed since checkout started; please review it again", 409)
+
+    snap = cart_snapshot(uid, cart_version)
+    if not snap["items"] and not snap["unavailable"]:
         return error("validation_error", "cart is empty", 400)
 
     # Transaction: create order, items, clear cart
     try:
-        subtotal_cents = 0
+        if snap["unavailable"]:
+            raise ValueError(f"product not found: {snap['unavailable'][0]}")
+
+        # Reserve stock first (conditional UPDATE per line); nothing is written if any line fails.
+        failed, prices = reserve_stock([(line["product_id"], line["quantity"]) for line in snap["items"]])
+        if failed:
+            db.session.rollback()
+            return error("out_of_stock", "not enough stock for some items", 409, details={"lines": failed})
+        # Charge the prices read while reserving stock, not the cached snapshot's
+        lines, summary = reprice(snap["items"], prices)
 
         order = Order(
             user_id=uid,
             status="placed",
+            total_cents=summary["total_cents"],
+            subtotal_cents=summary["subtotal_cents"],
+            tax_cents=summary["tax_cents"],
             created_at=datetime.utcnow(),
+            **order_summary((line["name"], line["image_url"], line["quantity"]) for line in lines),
         )
         db.session.add(order)
+        if new_address is not None:
+            db.session.add(new_address)
         db.session.flush()  # assigns order.id
 
-        # Bulk fetch products to avoid N+1
-        product_ids = [ci.product_id for ci in cart_items]
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        products_by_id = {p.id: p for p in products}
-
-        for ci in cart_items:
-            p = products_by_id.get(ci.product_id)
-            if not p:
-                raise ValueError(f"product not found: {ci.product_id}")
-
-            unit_price_cents = int(p.price_cents)
-            qty = int(ci.quantity)
-            if qty < 1:
-                raise ValueError("invalid quantity in cart")
-
-            subtotal_cents += unit_price_cents * qty
-
-            oi = OrderItem(
-                order_id=order.id,
-                product_id=p.id,
-                unit_price_cents=unit_price_cents,
-                quantity=qty,
-            )
-            db.session.add(oi)
-
-        tax_cents = int(subtotal_cents * TAX_RATE)
-        shipping_cents = 0
-        total_cents = subtotal_cents + tax_cents + shipping_cents
+        # All lines in one multi-row INSERT ... RETURNING (cart lines are unique per product)
+        rows = db.session.execute(
+            insert(OrderItem).returning(OrderItem.product_id, OrderItem.id),
+            [
+                {
+                    "order_id": order.id,
+                    "product_id": line["product_id"],
+                    "unit_price_cents": line["unit_price_cents"],
+                    "quantity": line["quantity"],
+                }
+                for line in lines
+            ],
+        )
+        item_ids = dict(rows.all())
 
-        # If your Order model has total_cents, set it. (Some teams add it; safe-guard.)
-        if hasattr(order, "total_cents"):
-            order.total_cents = total_cents
+        # Popularity rank (sort=popular) is updated in the same transaction.
+        record_sales([(line["product_id"], line["quantity"]) for line in lines], order.created_at)
 
-        # Clear cart (single statement)
+        # Clear cart (single statement), but only if it is still the version we priced
         CartItem.query.filter_by(user_id=uid).delete()
+        if not claim_cart_version(uid, cart_version):
+            db.session.rollback()
+            # a concurrent retry with the same key may have placed the order already
+            replayed = replay(uid, *idempotency) if idempotency else None
+            if replayed is not None:
+                return replayed
+            return error("cart_changed", "cart changed since checkout started; please review it again", 409)
+
+        # Include items in response for order confirmation UI. Built from the snapshot
+        # (no re-read), before commit so an Idempotency-Key can store it in the same transaction
+        order_data = order_to_dict(order)
+        order_data["items"] = [
+            {
+                "id": item_ids[line["product_id"]],
+                "product_id": line["product_id"],
+                "product_name": line["name"],
+                "unit_price_cents": line["unit_price_cents"],
+                "quantity": line["quantity"],
+                "line_total_cents": line["line_total_cents"],
+            }
+            for line in lines
+        ]
+        body = {
+            "order": order_data,
+            "payment_method": {
+                "id": pm.id,
+                "brand": pm.brand,
+                "last4": pm.last4,
+                "exp_month": pm.exp_month,
+                "exp_year": pm.exp_year,
+            },
+        }
+        if shipping is not None:
+            body["shipping"] = dict(shipping, address_id=new_address.id if new_address else shipping["address_id"])
+        if idempotency:
+            remember(uid, *idempotency, body=body, status=201, order_id=order.id)
+
+        # Sent by a job worker once this commits (jobs.py), not inside the request.
+        enqueue("send_order_confirmation", {"order_id": order.id})
 
         db.session.commit()
 
@@ -181,23 +391,122 @@ def create_order():
     except ValueError as ve:
         db.session.rollback()
         return error("validation_error", str(ve), 400)
+    except IntegrityError:
+        db.session.rollback()
+        replayed = replay(uid, *idempotency) if idempotency else None
+        if replayed is not None:
+            return replayed
+        return error("server_error", "could not create order", 500)
     except Exception:
         db.session.rollback()
         return error("server_error", "could not create order", 500)
 
-    # Include items in response for order confirmation UI
-    order = Order.query.filter_by(id=order.id, user_id=uid).first()
-    _ = order.items
-    return {
-        "order": order_to_dict(order, include_items=True),
-        "payment_method": {
-            "id": pm.id,
-            "brand": pm.brand,
-            "last4": pm.last4,
-            "exp_month": pm.exp_month,
-            "exp_year": pm.exp_year,
-        },
-    }, 201
+    return body, 201
+
+
+@bp.route("/orders", methods=["POST"], provide_automatic_options=False)
+def create_order():
+    """
+    Checkout:
+    - requires logged-in user
+    - requires payment method (explicit id OR default OR any)
+    - converts the user's cart snapshot (checkout.py) -> Order + OrderItems
+    - optional cart_version: 409 if the cart changed since it was shown
+    - clears cart
+    """
+    uid, err = require_user_id()
+    if err:
+        return err
+
+    payload = request.get_json(silent=True) or {}
+    idempotency, err = idempotency_for(uid, payload)
+    if err is not None:
+        return err
+    pm, err = payment_method_from_payload(uid, payload)
+    if err:
+        return err
+
+    return place_order(uid, pm, payload.get("cart_version"), idempotency=idempotency)
+
+
+def idempotency_for(uid: int, payload: dict):
+    """
+    ((key, fingerprint) or None, response or None). The response is either an
+    error or the stored result of an earlier request with the same key.
+    """
+    key, err = idempotency_key()
+    if err or not key:
+        return None, err
+    fingerprint = request_fingerprint(payload)
+    return (key, fingerprint), replay(uid, key, fingerprint)
+
+
+ADDRESS_FIELDS = {"street_address": None, "postal_code": 20, "country": 100, "label": 50}
+
+
+def address_from_payload(uid: int, payload: dict):
+    """
+    Shipping address for express checkout: a saved address_id, or an inline
+    `address` object. Returns (shipping dict, Address to save or None, error).
+    """
+    if payload.get("address_id") is not None:
+        try:
+            address_id = int(payload["address_id"])
+        except Exception:
+            return None, None, error("validation_error", "address_id must be an integer", 400)
+        addr = Address.query.filter_by(id=address_id, user_id=uid).first()
+        if not addr:
+            return None, None, error("validation_error", "invalid address_id for this user", 400)
+        return {
+            "address_id": addr.id,
+            "street_address": addr.street_address,
+            "postal_code": addr.postal_code,
+            "country": addr.country,
+        }, None, None
+
+    data = payload.get("address")
+    if not isinstance(data, dict):
+        return None, None, error("validation_error", "'address_id' or 'address' is required", 400)
+
+    cleaned = {}
+    for field, max_len in ADDRESS_FIELDS.items():
+        value = str(data.get(field) or "").strip()
+        if not value and field != "label":
+            return None, None, error("validation_error", f"'address.{field}' is required", 400)
+        if max_len and len(value) > max_len:
+            return None, None, error("validation_error", f"'address.{field}' must be at most {max_len} characters", 400)
+        cleaned[field] = value or None
+
+    new_address = Address(user_id=uid, **cleaned) if payload.get("save_address") else None
+    shipping = {"address_id": None, **{k: cleaned[k] for k in ("street_address", "postal_code", "country")}}
+    return shipping, new_address, None
+
+
+@bp.route("/checkout/express", methods=["POST"], provide_automatic_options=False)
+def express_checkout():
+    """
+    One-request checkout (no /checkout/* page steps):
+    - address_id, or address {street_address, postal_code, country[, label]}
+      (+ save_address: true to add it to the address book in the same transaction)
+    - payment_method_id (optional; same default rules as POST /orders)
+    - optional cart_version
+    """
+    uid, err = require_user_id()
+    if err:
+        return err
+
+    payload = request.get_json(silent=True) or {}
+    idempotency, err = idempotency_for(uid, payload)
+    if err is not None:
+        return err
+    shipping, new_address, err = address_from_payload(uid, payload)
+    if err:
+        return err
+    pm, err = payment_method_from_payload(uid, payload)
+    if err:
+        return err
+
+    return place_order(uid, pm, payload.get("cart_version"), new_address, idempotency, shipping)
 
 
 @bp.route("/orders/<int:order_id>", methods=["PATCH"], provide_automatic_options=False)
@@ -228,6 +537,8 @@ def patch_order(order_id: int):
         return error("validation_error", "order cannot be cancelled in its current status", 400)
 
     order.status = "cancelled"
+    record_sales([(oi.product_id, -oi.quantity) for oi in order.items], order.created_at)
+    release_stock([(oi.product_id, oi.quantity) for oi in order.items])
     db.session.commit()
 
     return order_to_dict(order, include_items=False), 200
@@ -251,6 +562,8 @@ def delete_order(order_id: int):
         return error("validation_error", "order cannot be cancelled in its current status", 400)
 
     order.status = "cancelled"
+    record_sales([(oi.product_id, -oi.quantity) for oi in order.items], order.created_at)
+    release_stock([(oi.product_id, oi.quantity) for oi in order.items])
     db.session.commit()
     return "", 204
 
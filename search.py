@@ -0,0 +1,164 @@
+"""
+Full-text search over products (name, description, sku).
+
+- SQLite: an external-content FTS5 table `products_fts` kept in sync by triggers.
+- PostgreSQL: a generated `search_tsv` tsvector column with a GIN index.
+
+Both are maintained by the database itself, so every product write (ORM, CLI seed,
+raw SQL) keeps the index in sync. If the index is missing (e.g. SQLite built
+without FTS5) callers fall back to the old ILIKE search.
+"""
+from __future__ import annotations
+
+import re
+import weakref
+
+from sqlalchemy import event, or_, text
+
+from db import db
+from models import Product
+
+# Matches the config used for the tsvector column + queries (no stemming; behaves
+# like the old substring search for SKUs and short product names).
+PG_TS_CONFIG = "simple"
+
+_SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, sku,
+        content='products', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description, sku)
+        VALUES (new.id, new.name, new.description, new.sku);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, sku)
+        VALUES ('delete', old.id, old.name, old.description, old.sku);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description, sku ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, sku)
+        VALUES ('delete', old.id, old.name, old.description, old.sku);
+        INSERT INTO products_fts(rowid, name, description, sku)
+        VALUES (new.id, new.name, new.description, new.sku);
+    END
+    """,
+]
+
+_PG_DDL = [
+    f"""
+    ALTER TABLE products ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('{PG_TS_CONFIG}',
+            coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(sku, ''))
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_search_tsv ON products USING GIN (search_tsv)",
+]
+
+# engine -> bool (is the search index present?)
+_available: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def install_search_index(conn) -> bool:
+    """Create the search index for the connection's dialect (idempotent).
+
+    Returns True if the index exists afterwards.
+    """
+    dialect = conn.dialect.name
+    try:
+        if dialect == "sqlite":
+            for stmt in _SQLITE_DDL:
+                conn.exec_driver_sql(stmt)
+            # Index any rows that existed before the FTS table was created.
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        elif dialect == "postgresql":
+            # Savepoint so a failure doesn't abort the surrounding create_all() transaction.
+            with conn.begin_nested():
+                for stmt in _PG_DDL:
+                    conn.exec_driver_sql(stmt)
+        else:
+            return False
+    except Exception:
+        # e.g. SQLite compiled without FTS5 -> keep the ILIKE fallback.
+        return False
+    return True
+
+
+@event.listens_for(Product.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    # Runs as part of db.create_all() so fresh databases (and tests) get the index.
+    install_search_index(connection)
+
+
+def search_available() -> bool:
+    engine = db.engine
+    cached = _available.get(engine)
+    if cached is not None:
+        return cached
+
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "sqlite":
+            found = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+            ).first()
+        elif dialect == "postgresql":
+            found = conn.execute(
+                text(
+                    "SELECT 1 FROM information_schema.columns "
+                    "WHERE table_name = 'products' AND column_name = 'search_tsv'"
+                )
+            ).first()
+        else:
+            found = None
+
+    # Only cache a positive answer; the index may be created later by init-db.
+    if found:
+        _available[engine] = True
+    return bool(found)
+
+
+def _tokens(term: str) -> list[str]:
+    return re.findall(r"\w+", term.lower())
+
+
+def apply_search(q, term: str):
+    """
+    Filter a Product query by `term`.
+
+    Returns (query, rank_expr). `rank_expr` is an ORDER BY expression for
+    relevance (best first), or None when only the ILIKE fallback is available.
+    Tokens are prefix-matched so search-as-you-type keeps working.
+    """
+    tokens = _tokens(term)
+    if not tokens or not search_available():
+        like = f"%{term}%"
+        q = q.filter(
+            or_(
+                Product.name.ilike(like),
+                Product.description.ilike(like),
+                Product.sku.ilike(like),
+            )
+        )
+        return q, None
+
+    if db.engine.dialect.name == "sqlite":
+        fts = db.table("products_fts", db.column("rowid"), db.column("rank"))
+        match = " ".join(f'"{t}"*' for t in tokens)
+        q = q.join(fts, fts.c.rowid == Product.id).filter(
+            db.literal_column("products_fts").op("MATCH")(match)
+        )
+        # FTS5 rank is bm25(): lower is better.
+        return q, fts.c.rank.asc()
+
+    tsv = db.literal_column("products.search_tsv")
+    tsquery = db.func.to_tsquery(PG_TS_CONFIG, " & ".join(f"{t}:*" for t in tokens))
+    q = q.filter(tsv.op("@@")(tsquery))
+    return q, db.func.ts_rank(tsv, tsquery).desc()
@@ -89,13 +89,25 @@ function bumpNavCartCount(delta) {
   setNavCartCount(current + d);
 }
 
+// Highest cart_version seen from the server. Cart mutations return the new version
+// (and the cart itself with ?include=cart), so a follow-up GET /api/cart is only
+// needed when a response doesn't carry a newer cart than the one already shown.
+let knownCartVersion = -1;
+
+function applyCartSnapshot(cart) {
+  if (!cart || typeof cart.cart_version !== "number") return false;
+  if (cart.cart_version < knownCartVersion) return true; // stale (out-of-order) response
+  knownCartVersion = cart.cart_version;
+  const count = (cart.items || []).reduce((sum, it) => sum + (parseInt(it.quantity || 0, 10) || 0), 0);
+  setNavCartCount(count);
+  return true;
+}
+
 async function refreshNavCartCount() {
   try {
     const res = await fetch("/api/cart", { credentials: "same-origin" });
     if (!res.ok) return;
-    const data = await res.json();
-    const count = (data.items || []).reduce((sum, it) => sum + (parseInt(it.quantity || 0, 10) || 0), 0);
-    setNavCartCount(count);
+    applyCartSnapshot(await res.json());
   } catch (_) {
     // ignore
   }
@@ -104,7 +116,7 @@ async function refreshNavCartCount() {
 async function addToCart(productId, quantity) {
   const qty = parseInt(quantity || 1, 10) || 1;
 
-  const res = await fetch("/api/cart/items", {
+  const res = await fetch("/api/cart/items?include=cart", {
     method: "POST",
     headers: {"Content-Type": "application/json"},
     credentials: "same-origin",
@@ -125,9 +137,11 @@ async function addToCart(productId, quantity) {
   if (msg) msg.textContent = "Added to cart.";
   showToast("Added to cart", "success");
 
-  // Update navbar badge instantly, then reconcile with server
-  bumpNavCartCount(qty);
-  refreshNavCartCount();
+  // The response carries the updated cart; only re-fetch if it didn't
+  if (!applyCartSnapshot(data.cart)) {
+    bumpNavCartCount(qty);
+    refreshNavCartCount();
+  }
 }
 
 async function updateQty(itemId, qty) {
@@ -161,9 +175,8 @@ async function placeOrder() {
   }
   if (el) el.textContent = `Order placed! Order ID: ${data.id}`;
   showToast("Order placed successfully", "success");
-  // Cart will be cleared server-side; update badge
+  // Cart is cleared server-side in the same transaction; no need to re-fetch it
   setNavCartCount(0);
-  refreshNavCartCount();
 }
 
 // --- Mobile navbar toggle ---
@@ -1,18 +1,80 @@
 import os
 import pytest
 
+# Use SQLite in tests for simplicity. Must be set before `app`/`config` are imported,
+# since Config reads DATABASE_URL at import time.
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+
 from app import create_app
 from db import db
+from models import Category, Product
 
 @pytest.fixture()
-def client():
-    # Use SQLite in tests for simplicity.
-    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+def app():
     app = create_app()
     app.config["TESTING"] = True
 
     with app.app_context():
         db.create_all()
 
+    yield app
+
+@pytest.fixture()
+def client(app):
     with app.test_client() as client:
         yield client
+
+
+@pytest.fixture()
+def make_products(app):
+    """
+    make_products(n=3, ...) adds products in one category and one commit:
+    "Bowl 0".."Bowl 2", 1500 cents, 50 in stock, SKUs BWL-000... Keyword
+    arguments change the defaults (price_cents may be a function of the index);
+    rows=[{"name": ..., ...}] gives explicit products instead.
+    """
+    def make(n=3, name="Bowl", category="Bowl", price_cents=1500, stock=50, rows=None):
+        if rows is None:
+            rows = [
+                {"name": f"{name} {i}", "price_cents": price_cents(i) if callable(price_cents) else price_cents}
+                for i in range(n)
+            ]
+        with app.app_context():
+            cat = Category(category_name=category)
+            db.session.add_all([
+                Product(**{"sku": f"BWL-{i:03d}", "description": f"{name}.", "stock": stock, **row}, category=cat)
+                for i, row in enumerate(rows)
+            ])
+            db.session.commit()
+
+    return make
+
+
+@pytest.fixture()
+def login(client):
+    """login(email=...) registers and signs in a user; payment_method=True also adds a card (needed for orders)."""
+    def log_in(email="shopper@example.com", payment_method=False):
+        client.post("/api/users", json={
+            "email": email, "password": "Secret123!", "first_name": "Test", "last_name": "Shopper",
+        })
+        assert client.post("/api/auth/login", json={"email": email, "password": "Secret123!"}).status_code == 200
+        if payment_method:
+            resp = client.post("/api/payment-methods", json={
+                "cardholder_name": "Test Shopper", "brand": "Visa", "last4": "4242", "exp_month": 12, "exp_year": 2040,
+            })
+            assert resp.status_code == 201
+
+    return log_in
+
+
+@pytest.fixture()
+def place_order(client):
+    """place_order([(product_id, quantity), ...]) adds the lines to the cart and checks out; returns the JSON body."""
+    def place(lines):
+        for product_id, qty in lines:
+            client.post("/api/cart/items", json={"product_id": product_id, "quantity": qty})
+        resp = client.post("/api/orders", json={})
+        assert resp.status_code == 201, resp.get_json()
+        return resp.get_json()
+
+    return place
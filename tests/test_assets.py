@@ -0,0 +1,35 @@
+import gzip
+
+from assets import build_assets, load_manifest
+
+
+def test_build_and_serve_fingerprinted_assets(app, tmp_path):
+    static = tmp_path / "static"
+    (static / "css").mkdir(parents=True)
+    css = b"body { color: #2f241f; }\n" * 200
+    (static / "css" / "site.css").write_bytes(css)
+
+    stats = build_assets(static)
+    manifest = load_manifest(static)
+    hashed = manifest["css/site.css"]
+    assert stats["files"] == 1 and hashed.startswith("css/site.") and hashed != "css/site.css"
+
+    app.static_folder = str(static)
+    app.extensions["asset_manifest"] = manifest
+    client = app.test_client()
+
+    with app.test_request_context():
+        from assets import asset_url
+        assert asset_url("css/site.css") == f"/assets/{hashed}"
+        assert asset_url("js/missing.js") == "/static/js/missing.js"
+
+    resp = client.get(f"/assets/{hashed}", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in resp.headers["Cache-Control"]
+    assert resp.mimetype == "text/css"
+    assert gzip.decompress(resp.data) == css
+
+    plain = client.get(f"/assets/{hashed}", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers and plain.data == css
+    assert client.get("/assets/manifest.json").status_code == 404
@@ -0,0 +1,180 @@
+import pytest
+
+from db import db
+from models import Product
+
+
+@pytest.fixture()
+def seed_products(make_products):
+    return lambda: make_products(category="Basket", stock=10, rows=[
+        {"name": "Basket A", "price_cents": 1000},
+        {"name": "Basket B", "price_cents": 2500},
+    ])
+
+
+def test_cart_etag_changes_only_when_cart_changes(app, client, seed_products, login):
+    seed_products()
+    login()
+
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 1})
+    etag = client.get("/api/cart").headers["ETag"]
+    assert client.get("/api/cart", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    resp = client.get("/api/cart", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert len(resp.get_json()["items"]) == 2
+
+
+def test_guest_cart_etag(app, client, seed_products):
+    seed_products()
+
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+    etag = client.get("/api/cart").headers["ETag"]
+    assert client.get("/api/cart", headers={"If-None-Match": etag}).status_code == 304
+
+    client.delete("/api/cart/items/session_1")
+    assert client.get("/api/cart", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_add_to_cart_upserts_existing_line(app, client, seed_products, login):
+    seed_products()
+    login()
+
+    assert client.post("/api/cart/items", json={"product_id": 1, "quantity": 1}).get_json()["quantity"] == 1
+    assert client.post("/api/cart/items", json={"product_id": 1, "quantity": 2}).get_json()["quantity"] == 3
+
+    items = client.get("/api/cart").get_json()["items"]
+    assert [(i["product_id"], i["quantity"]) for i in items] == [(1, 3)]
+
+
+def test_cart_batch_applies_operations_in_one_request(app, client, seed_products, login):
+    seed_products()
+    login()
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 1})
+    item_id = client.get("/api/cart").get_json()["items"][0]["id"]
+
+    resp = client.post("/api/cart/batch", json={"operations": [
+        {"op": "add", "product_id": 2, "quantity": 2},
+        {"op": "set", "item_id": item_id, "quantity": 5},
+        {"op": "add", "product_id": 2},
+    ]})
+    assert resp.status_code == 200
+    assert [(i["product_id"], i["quantity"]) for i in resp.get_json()["items"]] == [(1, 5), (2, 3)]
+
+    resp = client.post("/api/cart/batch", json={"operations": [{"op": "remove", "product_id": 1}]})
+    assert [i["product_id"] for i in resp.get_json()["items"]] == [2]
+
+
+def test_cart_batch_is_all_or_nothing(app, client, seed_products):
+    seed_products()
+
+    resp = client.post("/api/cart/batch", json={"operations": [
+        {"op": "add", "product_id": 1, "quantity": 1},
+        {"op": "add", "product_id": 99, "quantity": 1},
+    ]})
+    assert resp.status_code == 404
+    assert resp.get_json()["error"]["index"] == 1
+    assert client.get("/api/cart").get_json()["items"] == []
+
+    resp = client.post("/api/cart/batch", json={"operations": [
+        {"op": "add", "product_id": 1, "quantity": 2},
+        {"op": "set", "item_id": "session_1", "quantity": 4},
+    ]})
+    assert [(i["product_id"], i["quantity"]) for i in resp.get_json()["items"]] == [(1, 4)]
+
+
+def test_mutations_return_cart_version_and_optional_cart(app, client, seed_products, login):
+    seed_products()
+    login()
+
+    first = client.post("/api/cart/items?include=cart", json={"product_id": 1, "quantity": 2}).get_json()
+    assert first["cart"]["items"][0]["quantity"] == 2
+    assert first["cart"]["summary"]["subtotal_cents"] == 2000
+    assert first["cart_version"] == client.get("/api/cart").get_json()["cart_version"]
+
+    item_id = first["cart"]["items"][0]["id"]
+    second = client.put(f"/api/cart/items/{item_id}", json={"quantity": 1}).get_json()
+    assert "cart" not in second
+    assert second["cart_version"] > first["cart_version"]
+
+    third = client.delete(f"/api/cart/items/{item_id}?include=cart").get_json()
+    assert third["cart"]["items"] == [] and third["cart_version"] > second["cart_version"]
+
+
+def test_server_side_guest_cart_store(app, client, seed_products):
+    from datetime import datetime, timedelta
+    from guest_cart import purge_expired_guest_carts
+    from models import GuestCart
+
+    app.config["GUEST_CART_STORE"] = True
+    seed_products()
+
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    data = client.get("/api/cart").get_json()
+    assert [(i["product_id"], i["quantity"]) for i in data["items"]] == [(1, 2), (2, 1)]
+    assert data["cart_version"] == 2
+
+    with client.session_transaction() as sess:
+        assert "cart" not in sess and sess["guest_cart_token"]
+
+    with app.app_context():
+        row = GuestCart.query.one()
+        assert row.items == {"1": 2, "2": 1}
+        row.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+    assert client.get("/api/cart").get_json()["items"] == []
+
+    with app.app_context():
+        assert purge_expired_guest_carts() == 1
+        db.session.commit()
+
+
+def test_login_merges_guest_cart_in_bulk(app, client, seed_products):
+    seed_products()
+    client.post("/api/users", json={
+        "email": "merge@example.com", "password": "Secret123!", "first_name": "M", "last_name": "U",
+    })
+    client.post("/api/auth/login", json={"email": "merge@example.com", "password": "Secret123!"})
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 1})
+    client.post("/api/auth/logout")
+
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    with app.app_context():
+        db.session.delete(db.session.get(Product, 2))
+        db.session.commit()
+
+    assert client.post("/login", data={"email": "merge@example.com", "password": "Secret123!"}).status_code == 302
+    items = client.get("/api/cart").get_json()["items"]
+    assert [(i["product_id"], i["quantity"]) for i in items] == [(1, 3)]
+    with client.session_transaction() as sess:
+        assert "cart" not in sess
+
+
+def test_navbar_cart_count_is_cached_by_cart_version(app, client, seed_products, login):
+    from sqlalchemy import event
+
+    seed_products()
+    login()
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert b'data-count="2"' in client.get("/cart").data
+        first = [s for s in statements if "sum(" in s.lower()]
+        statements.clear()
+        assert b'data-count="2"' in client.get("/cart").data
+        assert not [s for s in statements if "sum(" in s.lower()]
+        assert len([s for s in statements if "FROM users" in s]) == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len(first) == 1
+
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    assert b'data-count="3"' in client.get("/cart").data
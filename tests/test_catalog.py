@@ -0,0 +1,194 @@
+import pytest
+
+from db import db
+from models import Category, Product
+
+
+@pytest.fixture()
+def seed_catalog(make_products):
+    """n "Box" products at three price points (ties exercise the id tie-breaker)."""
+    return lambda n=7: make_products(n=n, name="Box", category="Box", price_cents=lambda i: 1000 + (i % 3) * 100, stock=10)
+
+
+def walk(client, url):
+    seen, cursor = [], None
+    while True:
+        resp = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert resp.status_code == 200
+        data = resp.get_json()
+        seen.extend(p["id"] for p in data["items"])
+        cursor = data["paging"]["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def test_cursor_pages_match_offset_order(app, client, seed_catalog):
+    seed_catalog()
+
+    for sort in ("price_asc", "price_desc", "newest", "popular"):
+        full = [p["id"] for p in client.get(f"/api/products?limit=50&sort={sort}").get_json()["items"]]
+        assert walk(client, f"/api/products?limit=2&total=none&sort={sort}") == full
+
+
+def test_total_modes(app, client, seed_catalog):
+    seed_catalog()
+
+    assert client.get("/api/products?total=none").get_json()["paging"]["total"] is None
+    paging = client.get("/api/products?total=estimate").get_json()["paging"]
+    assert paging["total"] == 7 and paging["total_is_estimate"] is True
+    assert client.get("/api/products?total=bogus").status_code == 400
+
+
+def test_cursor_rejects_garbage_and_mismatched_sort(app, client, seed_catalog):
+    seed_catalog()
+
+    assert client.get("/api/products?cursor=not-a-cursor").status_code == 400
+    cursor = client.get("/api/products?limit=2&sort=newest").get_json()["paging"]["next_cursor"]
+    assert client.get(f"/api/products?sort=price_asc&cursor={cursor}").status_code == 400
+
+    from pagination import encode_cursor
+    for after in ({"a": 1, "b": 2}, [1200], [1200, 3, 4], ["1200", 3], [1200, True], [1200, 2 ** 70], None, "x"):
+        crafted = encode_cursor({"sort": "price_asc", "after": after})
+        assert client.get(f"/api/products?sort=price_asc&cursor={crafted}").status_code == 400, after
+    crafted = encode_cursor({"sort": "newest", "after": ["2026-01-01", 3]})
+    assert client.get(f"/api/products?sort=newest&cursor={crafted}").status_code == 400
+    crafted = encode_cursor({"after": [{"$dt": "2026-01-01T00:00:00"}, "x"]})
+    assert client.get(f"/api/products/1/reviews?cursor={crafted}").status_code == 400
+
+
+def test_review_updates_rating_aggregates(app, client, seed_catalog, login):
+    seed_catalog(n=2)
+    login()
+
+    client.post("/api/products/1/reviews", json={"rating": 5})
+    client.post("/api/products/1/reviews", json={"rating": 2})
+
+    summary = client.get("/api/products/1").get_json()["reviews_summary"]
+    assert summary["count"] == 2
+    assert summary["avg_rating"] == 3.5
+    assert summary["histogram"] == {"1": 0, "2": 1, "3": 0, "4": 0, "5": 1}
+
+    ids = [p["id"] for p in client.get("/api/products?sort=top_rated").get_json()["items"]]
+    assert ids == [1, 2]
+
+
+def test_rebuild_ratings_matches_incremental(app, client, seed_catalog, login):
+    seed_catalog(n=2)
+    login()
+    client.post("/api/products/2/reviews", json={"rating": 4})
+
+    from ratings import rebuild_rating_aggregates
+    with app.app_context():
+        rebuild_rating_aggregates()
+        db.session.commit()
+        p = db.session.get(Product, 2)
+        assert (p.rating_sum, p.rating_count, p.rating_avg, p.rating_4) == (4, 1, 4.0, 1)
+
+
+def test_reviews_are_cursor_paginated(app, client, seed_catalog, login):
+    seed_catalog(n=1)
+    for i in range(5):
+        login(email=f"reviewer{i}@example.com")
+        client.post("/api/products/1/reviews", json={"rating": 1 + i % 5, "comment": f"review {i}"})
+
+    detail = client.get("/api/products/1").get_json()
+    assert detail["reviews_summary"]["count"] == 5
+    assert len(detail["reviews"]) <= 10
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/products/1/reviews?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        data = client.get(url).get_json()
+        seen.extend(r["comment"] for r in data["items"])
+        cursor = data["paging"]["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [f"review {i}" for i in reversed(range(5))]
+    assert client.get("/api/products/999/reviews").status_code == 404
+
+
+def test_catalog_cache_hits_and_invalidates_on_writes(app, client, seed_catalog, login):
+    seed_catalog(n=2)
+
+    assert client.get("/api/catalog/cache-stats").status_code == 404
+    app.config["CATALOG_CACHE_STATS"] = True
+
+    client.get("/api/products?limit=5")
+    client.get("/api/products?limit=5")
+    stats = client.get("/api/catalog/cache-stats").get_json()["cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+    login()
+    client.post("/api/products/1/reviews", json={"rating": 5})
+    items = client.get("/api/products?limit=5").get_json()["items"]
+    assert items[0]["review_count"] == 1
+
+
+def test_lru_cache_evicts_and_expires():
+    from cache import LRUCache
+
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+    cache = LRUCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None and cache.stats()["expirations"] == 1
+
+
+def test_product_list_answers_if_none_match_with_304(app, client, seed_catalog, login):
+    seed_catalog(n=2)
+
+    first = client.get("/api/products")
+    etag = first.headers["ETag"]
+    again = client.get("/api/products", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b""
+
+    login()
+    client.post("/api/products/1/reviews", json={"rating": 3})
+    assert client.get("/api/products", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_catalog_version_is_shared_through_the_database(app, client, seed_catalog):
+    from sqlalchemy import update
+
+    from models import CatalogVersion
+
+    seed_catalog(n=2)
+    etag = client.get("/api/products").headers["ETag"]
+
+    with app.app_context():
+        assert db.session.get(CatalogVersion, 1).version == 1  # bumped by the seed commit
+        # another worker process (or a CLI command) bumps the version
+        db.session.execute(update(CatalogVersion).values(version=CatalogVersion.version + 1))
+        db.session.commit()
+
+    resp = client.get("/api/products", headers={"If-None-Match": etag})
+    assert resp.status_code == 200 and resp.headers["ETag"] != etag
+
+
+def test_facets_count_categories_prices_and_ratings(app, client):
+    with app.app_context():
+        box, candle = Category(category_name="Box"), Category(category_name="Candle")
+        db.session.add_all([
+            Product(sku="F1", name="Cozy Box", description="Gift.", price_cents=2000, category=box, stock=1),
+            Product(sku="F2", name="Big Box", description="Gift.", price_cents=12000, category=box, stock=1,
+                    rating_sum=9, rating_count=2, rating_avg=4.5),
+            Product(sku="F3", name="Lavender Candle", description="Gift.", price_cents=3000, category=candle, stock=1),
+            Category(category_name="Book"),
+        ])
+        db.session.commit()
+
+    facets = client.get("/api/products/facets").get_json()
+    assert {c["name"]: c["count"] for c in facets["categories"]} == {"Book": 0, "Box": 2, "Candle": 1}
+    assert [b["count"] for b in facets["price"]] == [1, 1, 0, 1]
+    assert facets["rating"][0] == {"key": "4_up", "min_rating": 4, "count": 1}
+
+    narrowed = client.get("/api/products/facets?q=box&category=box").get_json()
+    assert narrowed["total"] == 2
+    assert {c["name"]: c["count"] for c in narrowed["categories"]}["Candle"] == 0
+    assert [b["count"] for b in narrowed["price"]] == [1, 0, 0, 1]
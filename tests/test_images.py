@@ -0,0 +1,27 @@
+import pytest
+
+from images import build_variants, file_hash, source_path, srcset, variants_current
+
+
+def test_build_variants_is_incremental(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+
+    static = tmp_path / "static"
+    src = static / "images" / "products" / "Box01.jpg"
+    src.parent.mkdir(parents=True)
+    Image.new("RGB", (800, 600), "tan").save(src, "JPEG")
+
+    assert source_path("/static/images/products/Box01.jpg", static) == src.resolve()
+    assert source_path("/static/../secret.txt", static) is None
+
+    digest = file_hash(src)
+    variants = build_variants(src, digest, static)
+
+    # No upscaling: 320, 640 and the 800px original width.
+    assert [v["width"] for v in variants["webp"]] == [320, 640, 800]
+    assert variants["jpeg"][0]["height"] == 240
+    assert variants_current(variants, digest, static)
+    assert srcset(variants["webp"]).endswith("-800.webp 800w")
+
+    Image.new("RGB", (800, 600), "navy").save(src, "JPEG")
+    assert not variants_current(variants, file_hash(src), static)
@@ -0,0 +1,113 @@
+import threading
+from datetime import datetime, timedelta
+
+from flask import has_request_context
+
+from db import db
+from jobs import HANDLERS, claim_due_jobs, enqueue, job, run_pending
+from models import Job
+
+
+def test_order_confirmation_is_queued_then_written_to_outbox(app, client, tmp_path, make_products, login, place_order):
+    app.config["MAIL_OUTBOX_DIR"] = str(tmp_path)
+    make_products()
+    login(payment_method=True)
+
+    order = place_order([(1, 2)])["order"]
+
+    # Nothing is sent inside the request; the job is committed with the order.
+    assert list(tmp_path.iterdir()) == []
+    with app.app_context():
+        queued = Job.query.one()
+        assert (queued.name, queued.status, queued.payload) == (
+            "send_order_confirmation", "queued", {"order_id": order["id"]},
+        )
+
+    # Run it the way JobRunner / `flask run-jobs` do: another thread, app context
+    # only. (The `client` fixture keeps the last request context alive here.)
+    outcome = {}
+
+    def worker():
+        with app.app_context():
+            outcome["request_context"] = has_request_context()
+            outcome["stats"] = run_pending()
+            outcome["status"] = db.session.get(Job, queued.id).status
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert outcome == {"request_context": False, "stats": {"done": 1, "errors": 0}, "status": "done"}
+
+    [eml] = list(tmp_path.glob("*.eml"))
+    assert eml.is_file()
+    text = eml.read_text(encoding="utf-8")
+    assert "To: shopper@example.com" in text
+    assert f"Order #{order['id']}" in text
+    assert "2 x Bowl 0" in text
+
+    # the same job running again (e.g. requeued after JOB_LOCK_TIMEOUT) sends nothing new
+    with app.app_context():
+        row = db.session.get(Job, queued.id)
+        row.status = "queued"
+        db.session.commit()
+        assert run_pending() == {"done": 1, "errors": 0}
+    assert list(tmp_path.iterdir()) == [eml]
+
+
+def test_failing_job_retries_with_backoff_then_fails(app):
+    app.config.update(JOB_RETRY_BASE_SECONDS=10, JOB_MAX_ATTEMPTS=3)
+    calls = []
+
+    @job("test_flaky")
+    def flaky(payload):
+        calls.append(payload)
+        raise RuntimeError("mail server down")
+
+    try:
+        with app.app_context():
+            queued = enqueue("test_flaky", {"n": 1})
+            db.session.commit()
+            job_id = queued.id
+
+            delays = []
+            for _ in range(3):
+                before = datetime.utcnow()
+                assert run_pending() == {"done": 0, "errors": 1}
+                row = db.session.get(Job, job_id)
+                if row.status == "queued":
+                    delays.append(round((row.run_at - before).total_seconds()))
+                    # not due yet: a second pass runs nothing
+                    assert run_pending() == {"done": 0, "errors": 0}
+                    row.run_at = datetime.utcnow() - timedelta(seconds=1)
+                    db.session.commit()
+
+            row = db.session.get(Job, job_id)
+            assert (row.status, row.attempts) == ("failed", 3)
+            assert row.last_error == "RuntimeError: mail server down"
+            assert delays == [10, 20]
+            assert len(calls) == 3
+    finally:
+        HANDLERS.pop("test_flaky", None)
+
+
+def test_a_job_is_claimed_once_and_stale_claims_are_requeued(app):
+    @job("test_noop")
+    def noop(payload):
+        pass
+
+    try:
+        with app.app_context():
+            queued = enqueue("test_noop")
+            db.session.commit()
+            job_id = queued.id
+
+            assert claim_due_jobs(5) == [job_id]
+            assert claim_due_jobs(5) == []
+
+            # the worker that claimed it died; after JOB_LOCK_TIMEOUT it is picked up again
+            row = db.session.get(Job, job_id)
+            row.locked_at = datetime.utcnow() - timedelta(seconds=app.config["JOB_LOCK_TIMEOUT"] + 1)
+            db.session.commit()
+            assert claim_due_jobs(5) == [job_id]
+    finally:
+        HANDLERS.pop("test_noop", None)
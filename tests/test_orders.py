@@ -0,0 +1,373 @@
+from db import db
+from models import OrderItem, Product, ProductPopularity
+
+
+def test_popular_sort_follows_sales(app, client, monkeypatch, make_products, login, place_order):
+    import popularity
+    from cache import catalog_version
+
+    clock = [1_000_000.0]
+    monkeypatch.setattr(popularity.time, "time", lambda: clock[0])
+    make_products()
+    login(payment_method=True)
+
+    before = client.get("/api/products?sort=popular&total=none")
+    assert [p["id"] for p in before.get_json()["items"]] == [1, 2, 3]
+    with app.app_context():
+        version = catalog_version()
+
+    place_order([(3, 2), (2, 1)])
+    place_order([(3, 1)])
+
+    # orders leave the catalog version alone; the cached ranking holds for the window
+    with app.app_context():
+        assert catalog_version() == version
+    same = client.get("/api/products?sort=popular&total=none").get_json()["items"]
+    assert [(p["id"], p["stock"]) for p in same] == [(1, 50), (2, 49), (3, 47)]
+
+    clock[0] += app.config["POPULARITY_REFRESH_SECONDS"]
+    after = client.get("/api/products?sort=popular&total=none", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200 and after.headers["ETag"] != before.headers["ETag"]
+    assert [p["id"] for p in after.get_json()["items"]] == [3, 2, 1]
+
+
+def test_upserts_fall_back_to_update_then_insert(app, client, monkeypatch, make_products, login, place_order):
+    import db as db_module
+
+    # as on a database without INSERT ... ON CONFLICT
+    monkeypatch.setattr(db_module, "ON_CONFLICT_DIALECTS", ())
+    make_products()
+    login(payment_method=True)
+
+    assert client.post("/api/cart/items", json={"product_id": 2, "quantity": 1}).get_json()["quantity"] == 1
+    assert client.post("/api/cart/items", json={"product_id": 2, "quantity": 2}).get_json()["quantity"] == 3
+    place_order([(1, 1)])
+    place_order([(1, 2)])
+
+    with app.app_context():
+        assert db.session.get(ProductPopularity, 1).units_sold == 3
+        assert db.session.get(ProductPopularity, 2).units_sold == 3
+
+
+def test_cancel_retracts_sales_and_rebuild_matches(app, client, make_products, login, place_order):
+    make_products()
+    login(payment_method=True)
+
+    place_order([(1, 1)])
+    order = place_order([(2, 3)])["order"]
+    assert client.delete(f"/api/orders/{order['id']}").status_code == 204
+
+    from cache import catalog_version
+    from popularity import rebuild_popularity
+    with app.app_context():
+        incremental = {r.product_id: (r.units_sold, round(r.score, 6)) for r in ProductPopularity.query}
+        version = catalog_version()
+        rebuild_popularity()
+        db.session.commit()
+        assert catalog_version() == version
+        rebuilt = {r.product_id: (r.units_sold, round(r.score, 6)) for r in ProductPopularity.query}
+
+    assert incremental[1] == rebuilt[1]
+    assert incremental[2][0] == 0 and 2 not in rebuilt
+
+
+def test_create_order_refuses_a_cart_changed_since_review(app, client, make_products, login):
+    make_products()
+    login(payment_method=True)
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 1})
+    version = client.get("/api/cart").get_json()["cart_version"]
+
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    resp = client.post("/api/orders", json={"cart_version": version})
+    assert resp.status_code == 409
+    assert resp.get_json()["error"]["code"] == "cart_changed"
+
+    version = client.get("/api/cart").get_json()["cart_version"]
+    order = client.post("/api/orders", json={"cart_version": version}).get_json()["order"]
+    assert sorted(i["product_id"] for i in order["items"]) == [1, 2]
+    assert order["total_cents"] == 3000 + int(3000 * 0.13)
+
+
+def test_checkout_steps_share_one_cart_snapshot(app, client, monkeypatch, make_products, login):
+    import checkout
+
+    make_products()
+    login(payment_method=True)
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+
+    builds = []
+    real_build = checkout.build_cart_snapshot
+    monkeypatch.setattr(checkout, "build_cart_snapshot", lambda *a: builds.append(a) or real_build(*a))
+
+    assert client.get("/checkout/shipping").status_code == 200
+    assert client.get("/checkout/payment").status_code in (200, 302)
+    assert client.post("/api/orders", json={}).status_code == 201
+    assert len(builds) == 1
+
+
+def test_orders_charge_the_current_price_not_the_cached_snapshot(app, client, make_products, login):
+    from sqlalchemy import update
+
+    make_products()
+    login(payment_method=True)
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+    assert client.get("/checkout/shipping").status_code == 200  # snapshot cached at 1500
+
+    with app.app_context():
+        # a write the version stamp does not see (e.g. made directly in the database)
+        products = Product.__table__
+        db.session.execute(update(products).where(products.c.id == 1).values(price_cents=1700))
+        db.session.commit()
+
+    order = client.post("/api/orders", json={}).get_json()["order"]
+    assert order["items"][0]["unit_price_cents"] == 1700
+    assert order["total_cents"] == 3400 + int(3400 * 0.13)
+    with app.app_context():
+        assert db.session.get(OrderItem, order["items"][0]["id"]).unit_price_cents == 1700
+
+
+def test_express_checkout_in_one_request(app, client, make_products, login):
+    from models import Address, Order
+
+    make_products()
+    login(payment_method=True)
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 2})
+
+    resp = client.post("/api/checkout/express", json={"address_id": 999})
+    assert resp.status_code == 400
+
+    resp = client.post("/api/checkout/express", json={
+        "address": {"street_address": "1 King St W", "postal_code": "M5H 1A1", "country": "Canada"},
+        "save_address": True,
+    })
+    assert resp.status_code == 201
+    data = resp.get_json()
+    assert [(i["product_id"], i["quantity"]) for i in data["order"]["items"]] == [(2, 2)]
+    assert data["shipping"]["postal_code"] == "M5H 1A1" and data["shipping"]["address_id"]
+    assert data["payment_method"]["last4"] == "4242"
+    assert client.get("/api/cart").get_json()["items"] == []
+
+    resp = client.post("/api/checkout/express", json={"address_id": data["shipping"]["address_id"]})
+    assert resp.status_code == 400 and resp.get_json()["error"]["message"] == "cart is empty"
+    with app.app_context():
+        assert Address.query.count() == 1 and Order.query.count() == 1
+
+
+def test_orders_reserve_stock_and_report_short_lines(app, client, make_products, login, place_order):
+    make_products()
+    login(payment_method=True)
+
+    place_order([(1, 48)])
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 3})
+    client.post("/api/cart/items", json={"product_id": 2, "quantity": 1})
+    resp = client.post("/api/orders", json={})
+    assert resp.status_code == 409
+    lines = resp.get_json()["error"]["details"]["lines"]
+    assert lines == [{"product_id": 1, "requested": 3, "available": 2, "reason": "out_of_stock"}]
+
+    with app.app_context():
+        assert [db.session.get(Product, i).stock for i in (1, 2)] == [2, 50]
+
+    order_id = client.get("/api/orders").get_json()["items"][0]["id"]
+    assert client.delete(f"/api/orders/{order_id}").status_code == 204
+    with app.app_context():
+        assert db.session.get(Product, 1).stock == 50
+
+
+def test_catalog_responses_show_live_stock(app, client, make_products, login, place_order):
+    from sqlalchemy import update
+
+    from cache import catalog_version
+
+    make_products()
+    login(payment_method=True)
+
+    detail = client.get("/api/products/1")
+    listing = client.get("/api/products?sort=price_asc")
+    assert detail.get_json()["stock"] == 50
+
+    order = place_order([(1, 50)])["order"]
+    sold_out = client.get("/api/products/1", headers={"If-None-Match": detail.headers["ETag"]})
+    assert sold_out.status_code == 200 and sold_out.get_json()["stock"] == 0
+    assert sold_out.headers["ETag"] != detail.headers["ETag"]
+    relisted = client.get("/api/products?sort=price_asc", headers={"If-None-Match": listing.headers["ETag"]})
+    assert relisted.status_code == 200 and relisted.get_json()["items"][0]["stock"] == 0
+
+    # cancelling gives the stock back
+    assert client.delete(f"/api/orders/{order['id']}").status_code == 204
+    restocked = client.get("/api/products/1", headers={"If-None-Match": sold_out.headers["ETag"]})
+    assert restocked.status_code == 200 and restocked.get_json()["stock"] == 50
+    assert client.get("/api/products/1", headers={"If-None-Match": restocked.headers["ETag"]}).status_code == 304
+
+    # stock is read live, not through the catalog version
+    with app.app_context():
+        version = catalog_version()
+        db.session.execute(update(Product.__table__).where(Product.__table__.c.id == 2).values(stock=7))
+        db.session.commit()
+        assert catalog_version() == version
+    assert client.get("/api/products?sort=price_asc").get_json()["items"][1]["stock"] == 7
+
+
+def test_idempotency_key_replays_the_first_order(app, client, make_products, login):
+    from models import Order
+
+    make_products()
+    login(payment_method=True)
+    client.post("/api/cart/items", json={"product_id": 1, "quantity": 2})
+
+    headers = {"Idempotency-Key": "checkout-123"}
+    first = client.post("/api/orders", json={}, headers=headers)
+    assert first.status_code == 201
+
+    retry = client.post("/api/orders", json={}, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == first.get_json()
+
+    reused = client.post("/api/orders", json={"payment_method_id": 1}, headers=headers)
+    assert reused.status_code == 422
+
+    with app.app_context():
+        assert Order.query.count() == 1
+        assert db.session.get(Product, 1).stock == 48
+
+
+def test_order_lines_inserted_in_one_statement_without_reread(app, client, make_products, login):
+    from sqlalchemy import event
+
+    make_products()
+    login(payment_method=True)
+    for pid in (1, 2, 3):
+        client.post("/api/cart/items", json={"product_id": pid, "quantity": pid})
+
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        resp = client.post("/api/orders", json={})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert resp.status_code == 201
+    items = resp.get_json()["order"]["items"]
+    assert [(i["product_id"], i["quantity"], i["product_name"]) for i in items] == [
+        (1, 1, "Bowl 0"), (2, 2, "Bowl 1"), (3, 3, "Bowl 2"),
+    ]
+    assert len({i["id"] for i in items}) == 3
+    assert len([s for s in statements if s.startswith("INSERT INTO order_items")]) == 1
+    assert not [s for s in statements if "FROM order_items" in s or "FROM orders" in s]
+
+    order = client.get(f"/api/orders/{resp.get_json()['order']['id']}").get_json()
+    assert [i["id"] for i in order["items"]] == [i["id"] for i in items]
+
+
+def test_order_history_is_cursor_paginated(app, client, make_products, login, place_order):
+    make_products()
+    login(payment_method=True)
+    placed = [place_order([(1, 1)])["order"]["id"] for _ in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        data = client.get("/api/orders?limit=2" + (f"&cursor={cursor}" if cursor else "")).get_json()
+        assert len(data["items"]) <= 2
+        seen.extend(o["id"] for o in data["items"])
+        cursor = data["paging"]["next_cursor"]
+        if not cursor:
+            break
+    assert seen == sorted(placed, reverse=True)
+    assert client.get("/api/orders?cursor=garbage").status_code == 400
+
+    app.config["ORDERS_PAGE_SIZE"] = 2
+    page = client.get("/orders").data
+    assert b"Older orders" in page and f"Order #{placed[-1]}".encode() in page
+    assert f"Order #{placed[0]}".encode() not in page
+
+
+def test_order_list_etag_only_reads_the_visible_page(app, client, make_products, login, place_order):
+    from sqlalchemy import event
+
+    make_products()
+    login(payment_method=True)
+    placed = [place_order([(1, 1)])["order"]["id"] for _ in range(4)]
+
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, sql, *a: statements.append(sql)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        first = client.get("/api/orders?limit=2")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert not any("count(" in sql.lower() for sql in statements)
+    etag = first.headers["ETag"]
+
+    # a change on an older page leaves this page's ETag alone...
+    assert client.delete(f"/api/orders/{placed[0]}").status_code == 204
+    assert client.get("/api/orders?limit=2", headers={"If-None-Match": etag}).status_code == 304
+    # ...one on the visible page does not
+    assert client.delete(f"/api/orders/{placed[-1]}").status_code == 204
+    resp = client.get("/api/orders?limit=2", headers={"If-None-Match": etag})
+    assert resp.status_code == 200 and resp.get_json()["items"][0]["status"] == "cancelled"
+
+
+def test_order_summary_columns_and_backfill(app, client, make_products, login, place_order):
+    from sqlalchemy import event
+    from models import Order
+    from routes.orders import backfill_order_summaries
+
+    make_products()
+    login(payment_method=True)
+    first = place_order([(1, 2), (2, 1), (3, 1)])["order"]
+    place_order([(2, 1)])
+
+    with app.app_context():
+        order = db.session.get(Order, first["id"])
+        assert (order.subtotal_cents, order.tax_cents, order.item_count) == (6000, 780, 4)
+        assert order.preview == {"names": ["Bowl 0", "Bowl 1"], "more_count": 1, "image_url": None}
+
+        # simulate an order from before the columns existed
+        order.subtotal_cents = order.tax_cents = order.item_count = order.preview = None
+        db.session.commit()
+        assert backfill_order_summaries() == 1
+        db.session.commit()
+        order = db.session.get(Order, first["id"])
+        assert (order.subtotal_cents, order.tax_cents, order.item_count) == (6000, 780, 4)
+        engine = db.engine
+
+    statements = []
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        page = client.get("/orders").data
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert b"Bowl 0, Bowl 1" in page and b"+ 1 more" in page and b"4 items" in page
+    assert not [s for s in statements if "order_items" in s]
+
+
+def test_list_orders_can_embed_items_in_one_query(app, client, make_products, login, place_order):
+    from sqlalchemy import event
+
+    make_products()
+    login(payment_method=True)
+    for pid in (1, 2, 3):
+        place_order([(pid, 1), (((pid % 3) + 1), 2)])
+
+    with app.app_context():
+        engine = db.engine
+    statements = []
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        data = client.get("/api/orders?include=items").get_json()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert [len(o["items"]) for o in data["items"]] == [2, 2, 2]
+    assert data["items"][0]["items"][0]["product_name"] == "Bowl 2"
+    assert len([s for s in statements if "FROM order_items" in s]) == 1
+    assert "items" not in client.get("/api/orders").get_json()["items"][0]
+    assert client.get("/api/orders?include=bogus").status_code == 400
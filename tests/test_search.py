@@ -0,0 +1,40 @@
+import pytest
+
+from db import db
+from models import Product
+
+
+@pytest.fixture()
+def seed_products(make_products):
+    return lambda: make_products(category="Candle", stock=5, rows=[
+        {"sku": "BWL-LAV", "name": "Lavender Candle", "description": "Calming lavender soy candle.", "price_cents": 1500},
+        {"sku": "BWL-VAN", "name": "Vanilla Candle", "description": "Warm vanilla scent.", "price_cents": 1200},
+        {"sku": "BWL-BOX", "name": "Cozy Box", "description": "Socks, cocoa and a lavender sachet.", "price_cents": 3000},
+    ])
+
+
+def test_search_uses_index_and_prefix_matches(app, client, seed_products):
+    seed_products()
+
+    resp = client.get("/api/products?q=laven")
+    names = sorted(p["name"] for p in resp.get_json()["items"])
+    assert names == ["Cozy Box", "Lavender Candle"]
+
+
+def test_search_index_follows_product_updates(app, client, seed_products):
+    seed_products()
+    with app.app_context():
+        p = Product.query.filter_by(sku="BWL-VAN").first()
+        p.name = "Peppermint Candle"
+        db.session.commit()
+
+    assert client.get("/api/products?q=vanilla").get_json()["paging"]["total"] == 1
+    assert client.get("/api/products?q=peppermint").get_json()["paging"]["total"] == 1
+
+
+def test_sort_relevance_ranks_name_matches_first(app, client, seed_products):
+    seed_products()
+
+    resp = client.get("/api/products?q=lavender candle&sort=relevance")
+    items = resp.get_json()["items"]
+    assert items[0]["name"] == "Lavender Candle"